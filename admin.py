@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, redirect, url_for, request, flash
 from flask_login import login_required, current_user
 from werkzeug.security import generate_password_hash
 from models import User, db, Product
+from question_bank import question_bank
 
 
 admin_bp = Blueprint('admin', __name__)
@@ -55,6 +56,7 @@ def manage_products():
         new_product = Product(name=product_name, description=product_description)
         db.session.add(new_product)
         db.session.commit()
+        question_bank.invalidate()  # All workers reload the question bank
         flash('Product added successfully.')
 
         # Redirect back to the admin dashboard
@@ -72,6 +74,7 @@ def delete_product(product_id):
     if product:
         db.session.delete(product)
         db.session.commit()
+        question_bank.invalidate()  # All workers reload the question bank
         flash('Product deleted successfully.')
     else:
         flash('Product not found.')
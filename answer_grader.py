@@ -0,0 +1,181 @@
+# answer_grader.py
+# Local pre-grading of Reflect answers against the reference answer. Clear
+# cases get template feedback; only the ambiguous middle band is sent to the LLM.
+import os
+import re
+import random
+import logging
+import unicodedata
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from fuzzywuzzy import fuzz
+from transcript_correction import glossary_for
+
+# "local": answer clear cases from templates; "llm": always ask the LLM (local estimates are still logged)
+ANSWER_GRADER_MODE = os.getenv("ANSWER_GRADER_MODE", "local")
+ANSWER_GRADER_CORRECT_THRESHOLD = float(os.getenv("ANSWER_GRADER_CORRECT_THRESHOLD", 0.8))  # Score at or above: correct
+ANSWER_GRADER_INCORRECT_THRESHOLD = float(os.getenv("ANSWER_GRADER_INCORRECT_THRESHOLD", 0.2))  # Non-answers at or below: incorrect
+ANSWER_GRADER_MIN_WORDS = int(os.getenv("ANSWER_GRADER_MIN_WORDS", 3))  # Shorter answers are never graded correct locally
+ANSWER_GRADER_AUDIT_RATE = float(os.getenv("ANSWER_GRADER_AUDIT_RATE", 0.05))  # Share of local verdicts re-checked by the LLM
+
+# Calibration, against "Sum Assured on Death is paid to the nominee as a lump sum
+# if the life assured dies during the policy term.":
+#   0.87  "The nominee receives the sum assured on death as a lump sum during the policy term."  correct
+#   0.77  "On death during the term, the nominee is paid the sum assured in a lump sum."  ambiguous (LLM)
+#   0.19  "Maturity benefit is paid at the end of the term."  wrong, but...
+#   0.16  "If the policyholder dies, the family gets the money in one go."  ...a correct paraphrase scores lower.
+# Word overlap cannot tell a paraphrase from a wrong answer, so a low score only
+# grades "incorrect" for non-answers ("I don't know" 0.04, "पता नहीं" 0.01, empty
+# 0.0); anything else with a low score goes to the LLM. Against "The policy term
+# is 10 years ... 5 years under Limited Pay.", "I am not sure, maybe 10 years."
+# scores 0.21 and also goes to the LLM.
+# The reference with "is not paid" or "is never paid" scores 1.0: the added
+# negation keeps it from being graded correct, and the LLM decides.
+
+# Weights of the three signals in the combined score
+OVERLAP_WEIGHT = 0.4
+KEY_TERM_WEIGHT = 0.35
+FUZZY_WEIGHT = 0.25
+KEY_TERM_MATCH = 90  # partial_ratio for a key term to count as mentioned
+
+STOPWORDS = {
+    # English
+    "a", "an", "the", "is", "are", "was", "were", "be", "to", "of", "in", "on", "for", "and", "or", "it",
+    "this", "that", "with", "as", "by", "at", "from", "can", "will", "you", "your", "i", "we", "they",
+    "he", "she", "which", "also", "if", "so", "do", "does", "has", "have", "but", "am", "me", "my",
+    "m", "s", "t", "re", "ve", "ll", "d",  # Contraction fragments ("I'm", "it's")
+    # Hindi
+    "है", "हैं", "था", "थे", "की", "का", "के", "को", "में", "से", "और", "या", "पर", "यह", "वह", "जो",
+    "भी", "तो", "एक", "इस", "उस", "कि", "हो", "ही", "आप", "हम", "मैं", "लिए", "मुझे", "मेरा",
+}
+# Negation and polarity words: an answer that uses one the reference does not is never graded correct locally
+NEGATION_WORDS = {
+    "not", "no", "never", "nor", "neither", "none", "nothing", "nobody", "cannot", "without",
+    "नहीं", "न", "ना", "मत", "बिना",
+}
+NEGATED_CONTRACTION = re.compile(r"n['’]t\b", re.IGNORECASE)  # "isn't", "don't": tokenized as "isn", "t"
+# \w alone splits Devanagari at vowel signs ("पता" -> "पत"); include the block's letters and
+# marks, but not the danda (U+0964/U+0965)
+WORD_PATTERN = re.compile(r"[\w\u0900-\u0963\u0966-\u097F]+", re.UNICODE)
+NON_ANSWER_PATTERN = re.compile(
+    r"\b(?:don'?t know|do not know|no idea|not sure|can'?t remember|cannot remember|don'?t remember)\b"
+    r"|पता नहीं|नहीं पता|मालूम नहीं|नहीं मालूम|याद नहीं",
+    re.IGNORECASE
+)
+
+FEEDBACK_TEMPLATES = {
+    ("correct", "English"): "Your answer is correct. You covered the key points well. Let's move on to the next question.",
+    ("incorrect", "English"): "Your answer is incorrect. The correct answer is: {correct_answer} Don't worry, let's keep going.",
+    ("correct", "Hindi"): "आपका उत्तर सही है। आपने मुख्य बातें अच्छी तरह बताईं। चलिए अगले प्रश्न की ओर बढ़ते हैं।",
+    ("incorrect", "Hindi"): "आपका उत्तर गलत है। सही उत्तर है: {correct_answer} चिंता मत कीजिए, आगे बढ़ते हैं।",
+}
+
+# Verdict phrases the LLM grading prompts are told to use
+LLM_VERDICTS = [
+    ("partially correct", ("your answer is partially correct", "आपका उत्तर आंशिक रूप से सही है")),
+    ("incorrect", ("your answer is incorrect", "आपका उत्तर गलत है")),
+    ("correct", ("your answer is correct", "आपका उत्तर सही है")),
+]
+
+audit_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="grader-audit")
+
+
+@dataclass
+class GradeEstimate:
+    score: float
+    overlap: float
+    key_terms: float
+    fuzzy: float
+    verdict: str = None  # "correct", "incorrect" or None for the ambiguous band
+    negated: bool = False  # The answer has negation the reference lacks
+
+
+def content_words(text):
+    text = unicodedata.normalize("NFC", text or "").lower()
+    return [word for word in WORD_PATTERN.findall(text) if word not in STOPWORDS]
+
+
+def negation_words(text):
+    words = set(content_words(text)) & NEGATION_WORDS
+    if NEGATED_CONTRACTION.search(text or ""):
+        words.add("not")
+    return words
+
+
+def is_non_answer(user_answer):
+    """No content besides saying they don't know ("not sure, maybe 10 years" is an answer)."""
+    remainder = NON_ANSWER_PATTERN.sub(" ", user_answer or "")
+    return not (set(content_words(remainder)) - NEGATION_WORDS)
+
+
+def pre_grade(user_answer, correct_answer, product_name=None):
+    """Estimate how well user_answer covers correct_answer, from 0 to 1.
+
+    Combines recall of the reference's content words, coverage of the glossary
+    terms that occur in the reference, and a fuzzy token-set ratio. High scores
+    are graded correct unless the answer adds a negation the reference lacks
+    ("is not paid" keeps every content word of "is paid"). Low scores are only
+    graded incorrect for non-answers, since a paraphrase can share few words
+    with the reference. Everything else has no verdict and is left to the LLM.
+    """
+    answer_words = content_words(user_answer)
+    reference_words = set(content_words(correct_answer))
+    overlap = len(reference_words & set(answer_words)) / len(reference_words) if reference_words else 0.0
+
+    answer_text = " ".join(answer_words)
+    reference_text = (correct_answer or "").lower()
+    key_terms = [term.lower() for term in glossary_for(product_name) if term.lower() in reference_text]
+    if key_terms:
+        mentioned = sum(1 for term in key_terms if fuzz.partial_ratio(term, answer_text) >= KEY_TERM_MATCH)
+        key_term_coverage = mentioned / len(key_terms)
+    else:
+        key_term_coverage = overlap  # No glossary terms in the reference; lean on word overlap
+
+    fuzzy = fuzz.token_set_ratio(answer_text, " ".join(content_words(correct_answer))) / 100
+    score = OVERLAP_WEIGHT * overlap + KEY_TERM_WEIGHT * key_term_coverage + FUZZY_WEIGHT * fuzzy
+
+    estimate = GradeEstimate(score=round(score, 3), overlap=round(overlap, 3), key_terms=round(key_term_coverage, 3), fuzzy=round(fuzzy, 3))
+    estimate.negated = bool(negation_words(user_answer) - negation_words(correct_answer))
+    if score >= ANSWER_GRADER_CORRECT_THRESHOLD and len(answer_words) >= ANSWER_GRADER_MIN_WORDS and not estimate.negated:
+        estimate.verdict = "correct"
+    elif score <= ANSWER_GRADER_INCORRECT_THRESHOLD and is_non_answer(user_answer):
+        estimate.verdict = "incorrect"
+    return estimate
+
+
+def template_feedback(verdict, correct_answer, language):
+    language = "Hindi" if language == "Hindi" else "English"
+    return FEEDBACK_TEMPLATES[(verdict, language)].format(correct_answer=correct_answer)
+
+
+def llm_verdict(feedback_text):
+    """The verdict phrase in LLM feedback, or None if it used none of them."""
+    text = (feedback_text or "").lower()
+    for verdict, phrases in LLM_VERDICTS:
+        if any(phrase in text for phrase in phrases):
+            return verdict
+    return None
+
+
+def log_agreement(estimate, feedback_text, source):
+    """Log the local estimate next to the LLM's verdict, to tune the thresholds."""
+    verdict = llm_verdict(feedback_text)
+    agrees = None if estimate.verdict is None else estimate.verdict == verdict
+    logging.info(
+        f"Answer grader [{source}]: local={estimate.verdict} llm={verdict} agrees={agrees} "
+        f"score={estimate.score} overlap={estimate.overlap} key_terms={estimate.key_terms} fuzzy={estimate.fuzzy} negated={estimate.negated}"
+    )
+
+
+def maybe_audit(estimate, grade_with_llm):
+    """Re-check a sample of local verdicts with the LLM in the background and log agreement."""
+    if random.random() >= ANSWER_GRADER_AUDIT_RATE:
+        return
+
+    def audit():
+        try:
+            log_agreement(estimate, grade_with_llm(), "audit")
+        except Exception as e:
+            logging.error(f"Answer grader audit failed: {e}")
+
+    audit_executor.submit(audit)
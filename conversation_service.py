@@ -1,9 +1,15 @@
 # conversation_service.py
 from datetime import datetime
 from flask_login import current_user
-from flask import session
+from flask import session, current_app
 from extensions import db
-from models import Conversation, Message, Feedback, ReferConversation, ReferMessage, ReferFeedback
+from job_queue import job_handler, RetryLater
+from message_store import store_message
+from metrics import latest_system_sample
+from sqlalchemy import func, select
+from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Conversation, Message, Feedback, MessageFeedback, FeedbackDraft, ReferConversation, ReferMessage, ReferFeedback
 from langchain_google_genai import ChatGoogleGenerativeAI
 import os
 import google.generativeai as genai
@@ -11,14 +17,31 @@ from dotenv import load_dotenv
 from translate import Translator
 from googletrans import Translator
 import asyncio
+import json
+import re
 from concurrent.futures import ThreadPoolExecutor
 import textwrap
 import logging
-import psutil
 import time
+import threading
 
 
 MAX_QUERY_LENGTH = 500
+FEEDBACK_CONCURRENCY = int(os.getenv("FEEDBACK_CONCURRENCY", 5))  # Max in-flight per-message feedback requests
+# "structured": one LLM call returning JSON for the whole conversation, falling back
+# to "per_message" (one overall prompt plus one prompt per agent message) if it fails validation
+FEEDBACK_MODE = os.getenv("FEEDBACK_MODE", "structured")
+# Compute per-turn feedback and a running overall summary in the background as agent
+# messages arrive, so close only fills in what is missing. FEEDBACK_MODE then applies
+# only to conversations that had nothing precomputed.
+FEEDBACK_PRECOMPUTE = os.getenv("FEEDBACK_PRECOMPUTE", "true").lower() == "true"
+FEEDBACK_BACKGROUND_WORKERS = int(os.getenv("FEEDBACK_BACKGROUND_WORKERS", 2))
+FEEDBACK_PRECOMPUTE_DEBOUNCE = float(os.getenv("FEEDBACK_PRECOMPUTE_DEBOUNCE", 5))  # Seconds to gather turns into one refresh
+# Longest the closing feedback waits for the messages the client sent to reach the
+# database (write-behind buffers of other web workers, or a save still in flight)
+FEEDBACK_MESSAGE_WAIT = float(os.getenv("FEEDBACK_MESSAGE_WAIT", 30))
+PAST_CONVERSATIONS_PAGE_SIZE = int(os.getenv("PAST_CONVERSATIONS_PAGE_SIZE", 20))
+PAST_CONVERSATIONS_MAX_PAGE_SIZE = 100
 
 load_dotenv()
 
@@ -33,7 +56,8 @@ llm = ChatGoogleGenerativeAI(model="gemini-pro", convert_system_message_to_human
 """
 async def translate_to_hindi(text):
     translator = Translator()
-    translation = translator.translate(text, dest='hi')
+    # googletrans is blocking; run it in a thread so concurrent feedback tasks overlap
+    translation = await asyncio.to_thread(translator.translate, text, dest='hi')
     return translation.text
 
 
@@ -47,13 +71,16 @@ def start_conversation(user_id, persona):
 
 
 def add_message(conversation_id, sender, content):
+    """Save a chat message; returns None when it is buffered for write-behind (see message_store)."""
+    after_commit = None
+    if FEEDBACK_PRECOMPUTE and sender == 'user':
+        # Only refresh the feedback once the agent's message is actually in the database
+        app, language = current_app._get_current_object(), session.get('language', 'Hindi')
+        after_commit = lambda: feedback_precomputer.schedule(app, conversation_id, language)
+    return store_message(Message, after_commit=after_commit, conversation_id=conversation_id, sender=sender, content=content)
 
-    message = Message(conversation_id=conversation_id, sender=sender, content=content)
-    db.session.add(message)
-    db.session.commit()
-
-async def generate_overall_feedback(conversation):
-    language = session.get('language', 'Hindi')  # Default to Hindi if not set
+async def generate_overall_feedback(conversation, language=None):
+    language = language or session.get('language', 'Hindi')  # Default to Hindi if not set
 
     print("feedback language",language)
     formatted_conversation = "\n".join([f"{'Customer' if msg.sender == 'system' else 'Agent'}: {msg.content}" for msg in conversation.messages])
@@ -103,70 +130,400 @@ async def generate_overall_feedback(conversation):
     return final_feedback
 
 
+async def update_overall_draft(conversation, language):
+    """Bring the running overall feedback up to date with the conversation; returns it.
+
+    Only messages the draft does not cover yet go into the prompt, with the
+    previous draft as context, and the feedback is written directly in the
+    target language so there is nothing to translate. The caller commits.
+    """
+    messages = sorted(conversation.messages, key=lambda m: m.id)
+    draft = FeedbackDraft.query.filter_by(conversation_id=conversation.id).first()
+    if draft and draft.language == language:
+        previous, covered = draft.overall, draft.message_count
+    else:
+        previous, covered = None, 0  # No draft yet, or the language changed: start over
+    if covered >= len(messages):
+        return previous
+
+    new_lines = "\n".join(f"{'Customer' if msg.sender == 'system' else 'Agent'}: {msg.content}" for msg in messages[covered:])
+    language_name = "Hindi" if language == 'Hindi' else "English"
+    if previous:
+        context = (
+            f"Feedback on the conversation so far:\n{previous}\n"
+            f"The conversation continued:\n{new_lines}\n\n"
+            "Update the feedback so it covers the whole conversation, including how it continued."
+        )
+    else:
+        context = f"Conversation:\n{new_lines}"
+    prompt = (
+        "Based on the following conversation between an insurance agent and a customer, provide feedback on the agent's performance. "
+        "The feedback should reflect how the conversation started, how the agent responded to queries, and how the conversation ended.\n"
+        f"Write the comments in simple {language_name} language, under the headings 'Positives' and 'Needs Improvement' kept in English. "
+        "Do not generate or write '***' in feedback text.\n\n"
+        f"{context}\n\nOverall Feedback:"
+    )
+    response = await llm_invoke(prompt)
+    if not response or not response.content:
+        raise ValueError("empty overall feedback response")
+    overall = process_feedback(response.content) + "\n"
+
+    statement = sqlite_insert(FeedbackDraft).values(
+        conversation_id=conversation.id, language=language, overall=overall,
+        message_count=len(messages), updated_at=datetime.utcnow()
+    )
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['conversation_id'],
+        set_={column: statement.excluded[column] for column in ('language', 'overall', 'message_count', 'updated_at')}
+    ))
+    return overall
+
+
+
+async def request_message_feedback(message, language):
+    """Feedback text (translated when needed) for one agent message; raises on failure."""
+    if language == 'Hindi':
+        individual_prompt = (
+            "Provide feedback on the following response from the agent in simple Hindi language. "
+            "Indicate whether it was 'Positive' or 'Needs Improvement' only if necessary and provide specific comments on how it could be improved if needed. These indicators should be in English."
+            "Consider the overall chat conversation as context. Do not generate '***' in feedback text.\n\n"
+            f"Your response: {message.content}\n\nFeedback:"
+        )
+    else:
+        individual_prompt = (
+            "Provide feedback on the following response from the agent in simple English language. "
+            "Indicate whether it was 'Positive' or 'Needs Improvement' only if necessary and provide specific comments on how it could be improved if needed."
+            "Consider the overall chat conversation as context. Do not generate '***' in feedback text.\n\n"
+            f"Your response: {message.content}\n\nFeedback:"
+        )
+
+    individual_response = await llm_invoke(individual_prompt)
+    if not individual_response or not individual_response.content:
+        raise ValueError("empty feedback response")
+    feedback_text = individual_response.content
+
+    # Translate individual feedback only if language is Hindi
+    if language == 'Hindi':
+        feedback_text = await translate_to_hindi(feedback_text)
+    return feedback_text
+
 
-async def generate_feedback(conversation):
-    language = session.get('language', 'Hindi')  # Default to Hindi if not set
+async def generate_individual_feedback(message, language, semaphore):
+    """Formatted feedback for one agent message; never raises."""
+    async with semaphore:
+        try:
+            feedback_text = await request_message_feedback(message, language)
+        except Exception as e:
+            logging.error(f"Error generating feedback for message {message.id}: {e}")
+            feedback_text = "Could not generate individual feedback at this time."
+
+    return format_individual_feedback(message.content, feedback_text, language)
+
+
+def format_individual_feedback(content, feedback_text, language):
+    if language == 'Hindi':
+        return f"आपका जवाब: {content}\nफ़ीडबैक: {feedback_text}"
+    return f"Your response: {content}\nFeedback: {feedback_text}"
+
+
+def combine_feedback(overall_feedback, individual_feedback_list, language):
+    if language == 'Hindi':
+        return f"कुल फ़ीडबैक:\n{overall_feedback}\n\nव्यक्तिगत फ़ीडबैक:\n" + "\n\n".join(
+            individual_feedback_list)
+    return f"Overall Feedback:\n{overall_feedback}\n\nIndividual Feedback:\n" + "\n\n".join(
+        individual_feedback_list)
+
+
+# Shape of the JSON requested in structured feedback mode
+STRUCTURED_FEEDBACK_SCHEMA = {
+    "type": "object",
+    "required": ["overall", "turns"],
+    "properties": {
+        "overall": {
+            "type": "object",
+            "required": ["positives", "needs_improvement"],
+            "properties": {
+                "positives": {"type": "array", "items": {"type": "string"}},
+                "needs_improvement": {"type": "array", "items": {"type": "string"}}
+            }
+        },
+        "turns": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["turn", "verdict", "comment"],
+                "properties": {
+                    "turn": {"type": "integer"},
+                    "verdict": {"type": "string", "enum": ["Positive", "Needs Improvement"]},
+                    "comment": {"type": "string"}
+                }
+            }
+        }
+    }
+}
+
+_SCHEMA_TYPES = {"object": dict, "array": list, "string": str, "integer": int}
+
+
+def validate_against_schema(value, schema, path="$"):
+    """Check value against the small JSON-schema subset used above; raises ValueError."""
+    expected_type = _SCHEMA_TYPES[schema["type"]]
+    if not isinstance(value, expected_type) or (expected_type is int and isinstance(value, bool)):
+        raise ValueError(f"{path}: expected {schema['type']}")
+    if "enum" in schema and value not in schema["enum"]:
+        raise ValueError(f"{path}: {value!r} is not one of {schema['enum']}")
+    if expected_type is dict:
+        for key in schema.get("required", []):
+            if key not in value:
+                raise ValueError(f"{path}: missing '{key}'")
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in value:
+                validate_against_schema(value[key], sub_schema, f"{path}.{key}")
+    if expected_type is list and "items" in schema:
+        for index, item in enumerate(value):
+            validate_against_schema(item, schema["items"], f"{path}[{index}]")
+
+
+def parse_structured_feedback(raw_text, turn_count):
+    """Extract and validate the JSON feedback payload; raises ValueError if unusable."""
+    match = re.search(r"\{.*\}", raw_text or "", re.S)  # Tolerate ```json fences and stray prose
+    if not match:
+        raise ValueError("no JSON object in response")
+    payload = json.loads(match.group(0))
+    validate_against_schema(payload, STRUCTURED_FEEDBACK_SCHEMA)
+
+    turns = {turn["turn"]: turn for turn in payload["turns"]}
+    missing = [number for number in range(1, turn_count + 1) if number not in turns]
+    if missing:
+        raise ValueError(f"no verdict for agent turns {missing}")
+    payload["turns"] = [turns[number] for number in range(1, turn_count + 1)]
+    return payload
+
+
+async def generate_structured_feedback(conversation, agent_messages, language):
+    """Whole-conversation feedback from a single LLM call, in the combined text format."""
+    transcript_lines = []
+    turn_number = 0
+    for msg in conversation.messages:
+        if msg.sender == 'user':
+            turn_number += 1
+            transcript_lines.append(f"Agent [turn {turn_number}]: {msg.content}")
+        else:
+            transcript_lines.append(f"Customer: {msg.content}")
+    formatted_conversation = "\n".join(transcript_lines)
+
+    language_name = "Hindi" if language == 'Hindi' else "English"
+    prompt = (
+        "Based on the following conversation between an insurance agent and a customer, evaluate the agent's performance. "
+        "Consider how the conversation started, how the agent responded to queries, and how the conversation ended.\n"
+        f"Write every comment in simple {language_name} language. Keep the verdict values exactly 'Positive' or 'Needs Improvement' in English.\n"
+        f"Give one verdict for each of the {turn_number} numbered agent turns, using the turn number shown in the conversation.\n"
+        "Respond with JSON only, with no markdown and no '***', matching this JSON schema:\n"
+        f"{json.dumps(STRUCTURED_FEEDBACK_SCHEMA)}\n\n"
+        f"Conversation:\n{formatted_conversation}\n\nJSON:"
+    )
+
+    response = await llm_invoke(prompt)
+    payload = parse_structured_feedback(response.content if response else "", len(agent_messages))
+
+    # Same shape process_feedback() produces: one point per category
+    overall_lines = ["Positives:"] + payload["overall"]["positives"][:1]
+    overall_lines += ["Needs Improvement:"] + payload["overall"]["needs_improvement"][:1]
+    overall_feedback = "\n".join(overall_lines) + "\n"
+
+    individual_feedback_list = [
+        format_individual_feedback(message.content, f"{turn['verdict']}: {turn['comment']}", language)
+        for message, turn in zip(agent_messages, payload["turns"])
+    ]
+    return combine_feedback(overall_feedback, individual_feedback_list, language)
+
+
+async def generate_feedback(conversation, language=None):
+    language = language or session.get('language', 'Hindi')  # Default to Hindi if not set
     if not conversation or not conversation.messages:
         return "Feedback could not be generated due to missing conversation details."
 
-    # Generate overall feedback
-    overall_feedback = await generate_overall_feedback(conversation)
+    agent_messages = [message for message in conversation.messages if message.sender == 'user']
+
+    if FEEDBACK_MODE == "structured":
+        log_system_usage("Before structured feedback generation")
+        try:
+            combined_feedback = await generate_structured_feedback(conversation, agent_messages, language)
+            log_system_usage("After structured feedback generation")
+            return combined_feedback
+        except Exception as e:
+            logging.warning(f"Structured feedback failed for conversation {conversation.id}, using per-message feedback: {e}")
+
+    log_system_usage("Before feedback generation")
+
+    # Overall feedback and every per-message feedback run concurrently; at most
+    # FEEDBACK_CONCURRENCY per-message LLM/translation calls are in flight at once.
+    semaphore = asyncio.Semaphore(FEEDBACK_CONCURRENCY)
+    results = await asyncio.gather(
+        generate_overall_feedback(conversation, language),
+        *[generate_individual_feedback(message, language, semaphore) for message in agent_messages],
+        return_exceptions=True
+    )
 
+    overall_feedback = results[0]
+    if isinstance(overall_feedback, Exception):
+        logging.error(f"Error generating overall feedback for conversation {conversation.id}: {overall_feedback}")
+        overall_feedback = None
     # If overall feedback is not generated, provide a placeholder
     if not overall_feedback:
         overall_feedback = "No overall feedback available."
 
-    log_system_usage("Before individual feedback generation")
-
-    # Generate individual feedback
-    individual_feedback_list = []
-    for message in conversation.messages:
-        if message.sender == 'user':
-            if language == 'Hindi':
-                individual_prompt = (
-                    "Provide feedback on the following response from the agent in simple Hindi language. "
-                    "Indicate whether it was 'Positive' or 'Needs Improvement' only if necessary and provide specific comments on how it could be improved if needed. These indicators should be in English."
-                    "Consider the overall chat conversation as context. Do not generate '***' in feedback text.\n\n"
-                    f"Your response: {message.content}\n\nFeedback:"
-                )
-            else:
-                individual_prompt = (
-                    "Provide feedback on the following response from the agent in simple English language. "
-                    "Indicate whether it was 'Positive' or 'Needs Improvement' only if necessary and provide specific comments on how it could be improved if needed."
-                    "Consider the overall chat conversation as context. Do not generate '***' in feedback text.\n\n"
-                    f"Your response: {message.content}\n\nFeedback:"
-                )
-
-            individual_response = await llm_invoke(individual_prompt)
-            feedback_text = individual_response.content if individual_response else "Could not generate individual feedback at this time."
-
-            # Translate individual feedback only if language is Hindi
-            if language == 'Hindi':
-                translated_feedback_text = await translate_to_hindi(feedback_text)
-                individual_feedback_list.append(f"आपका जवाब: {message.content}\nफ़ीडबैक: {translated_feedback_text}")
-            else:
-                individual_feedback_list.append(f"Your response: {message.content}\nFeedback: {feedback_text}")
+    # gather() keeps the input order, so feedback stays in message order
+    individual_feedback_list = list(results[1:])
 
     log_system_usage("After individual feedback generation")
 
-    # Combine feedback
-    if language == 'Hindi':
-        combined_feedback = f"कुल फ़ीडबैक:\n{overall_feedback}\n\nव्यक्तिगत फ़ीडबैक:\n" + "\n\n".join(
-            individual_feedback_list)
-    else:
-        combined_feedback = f"Overall Feedback:\n{overall_feedback}\n\nIndividual Feedback:\n" + "\n\n".join(
-            individual_feedback_list)
+    combined_feedback = combine_feedback(overall_feedback, individual_feedback_list, language)
 
     log_system_usage("After generating combined feedback")
 
     return combined_feedback
 
 
+def save_turn_feedback(message, language, content):
+    # Upsert: another worker may have stored this turn meanwhile
+    statement = sqlite_insert(MessageFeedback).values(
+        message_id=message.id, conversation_id=message.conversation_id, language=language,
+        content=content, created_at=datetime.utcnow()
+    )
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['message_id', 'language'],
+        set_={'content': statement.excluded.content, 'created_at': statement.excluded.created_at}
+    ))
+
+
+async def refresh_turn_feedback(conversation_id, language):
+    """Compute feedback for agent turns that do not have it yet and update the overall draft."""
+    conversation = Conversation.query.get(conversation_id)
+    if not conversation or Feedback.query.filter_by(conversation_id=conversation_id).first():
+        return  # Gone or already closed
+
+    done = {row.message_id for row in MessageFeedback.query.filter_by(conversation_id=conversation_id, language=language)}
+    todo = [message for message in conversation.messages if message.sender == 'user' and message.id not in done]
+
+    semaphore = asyncio.Semaphore(FEEDBACK_CONCURRENCY)
+
+    async def limited(message):
+        async with semaphore:
+            return await request_message_feedback(message, language)
+
+    results = await asyncio.gather(
+        update_overall_draft(conversation, language),
+        *[limited(message) for message in todo],
+        return_exceptions=True
+    )
+    if isinstance(results[0], Exception):
+        logging.error(f"Background overall feedback failed for conversation {conversation_id}: {results[0]}")
+    for message, result in zip(todo, results[1:]):
+        if isinstance(result, Exception):
+            logging.error(f"Background feedback failed for message {message.id}: {result}")
+            continue  # Retried on the next refresh or at close
+        save_turn_feedback(message, language, result)
+    db.session.commit()
+
+
+class FeedbackPrecomputer:
+    """Runs refresh_turn_feedback in background threads, one refresh at a time per conversation.
+
+    A refresh starts FEEDBACK_PRECOMPUTE_DEBOUNCE seconds after the first
+    message that asks for it, so a quick run of turns is covered by one pass;
+    messages that arrive while a refresh is running get one follow-up refresh.
+    """
+
+    def __init__(self, max_workers, debounce):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.debounce = debounce
+        self._lock = threading.Lock()
+        self._scheduled = {}  # Conversation id -> language, waiting for the debounce timer
+        self._running = set()
+        self._pending = {}
+
+    def schedule(self, app, conversation_id, language):
+        with self._lock:
+            already_scheduled = conversation_id in self._scheduled
+            self._scheduled[conversation_id] = language
+        if not already_scheduled:
+            timer = threading.Timer(self.debounce, self._submit, args=(app, conversation_id))
+            timer.daemon = True
+            timer.start()
+
+    def _submit(self, app, conversation_id):
+        with self._lock:
+            language = self._scheduled.pop(conversation_id)
+            if conversation_id in self._running:
+                self._pending[conversation_id] = language
+                return
+            self._running.add(conversation_id)
+        self.executor.submit(self._run, app, conversation_id, language)
+
+    def _run(self, app, conversation_id, language):
+        while True:
+            try:
+                with app.app_context():
+                    asyncio.run(refresh_turn_feedback(conversation_id, language))
+            except Exception as e:
+                logging.error(f"Error refreshing turn feedback for conversation {conversation_id}: {e}")
+            with self._lock:
+                if conversation_id not in self._pending:
+                    self._running.discard(conversation_id)
+                    return
+                language = self._pending.pop(conversation_id)
+
+
+feedback_precomputer = FeedbackPrecomputer(FEEDBACK_BACKGROUND_WORKERS, FEEDBACK_PRECOMPUTE_DEBOUNCE)
+
+
+async def assemble_feedback(conversation, language=None):
+    """Feedback built from the background per-turn results and overall draft.
+
+    Turns without a stored result are computed now, and the draft is brought up
+    to date with whatever it does not cover yet, alongside them.
+    """
+    language = language or session.get('language', 'Hindi')  # Default to Hindi if not set
+    precomputed = {
+        row.message_id: row.content
+        for row in MessageFeedback.query.filter_by(conversation_id=conversation.id, language=language)
+    }
+    draft = FeedbackDraft.query.filter_by(conversation_id=conversation.id, language=language).first()
+    if not precomputed and not draft:
+        return await generate_feedback(conversation, language)  # Nothing was computed in the background
+
+    agent_messages = [message for message in conversation.messages if message.sender == 'user']
+    missing = [message for message in agent_messages if message.id not in precomputed]
+    logging.debug(f"Assembling feedback for conversation {conversation.id}: {len(agent_messages) - len(missing)}/{len(agent_messages)} turns precomputed")
+
+    semaphore = asyncio.Semaphore(FEEDBACK_CONCURRENCY)
+    results = await asyncio.gather(
+        update_overall_draft(conversation, language),
+        *[generate_individual_feedback(message, language, semaphore) for message in missing],
+        return_exceptions=True
+    )
+
+    overall_feedback = results[0]
+    if isinstance(overall_feedback, Exception):
+        logging.error(f"Error generating overall feedback for conversation {conversation.id}: {overall_feedback}")
+        overall_feedback = draft.overall if draft else None  # A slightly stale draft beats none
+    if not overall_feedback:
+        overall_feedback = "No overall feedback available."
+    computed = dict(zip((message.id for message in missing), results[1:]))
+
+    individual_feedback_list = [
+        computed[message.id] if message.id in computed
+        else format_individual_feedback(message.content, precomputed[message.id], language)
+        for message in agent_messages
+    ]
+    return combine_feedback(overall_feedback, individual_feedback_list, language)
+
+
 def log_system_usage(context=""):
-    process = psutil.Process()
-    memory_info = process.memory_info()
-    cpu_usage = process.cpu_percent(interval=1)
-    logging.debug(f"{context} - Memory Usage: RSS={memory_info.rss / 1024 ** 2:.2f} MB, VMS={memory_info.vms / 1024 ** 2:.2f} MB, CPU Usage={cpu_usage:.2f}%")
+    # Reads the background sampler's latest values instead of blocking to measure CPU
+    sample = latest_system_sample()
+    logging.debug(f"{context} - Memory Usage: RSS={sample['rss_bytes'] / 1024 ** 2:.2f} MB, VMS={sample['vms_bytes'] / 1024 ** 2:.2f} MB, CPU Usage={sample['cpu_percent']:.2f}%")
 
 def process_feedback(feedback):
     lines = feedback.split('\n')
@@ -198,7 +555,41 @@ async def llm_invoke(prompt):
     return response
 
 
-async def close_conversation(app, conversation_id):
+async def build_conversation_feedback(conversation, language=None):
+    if FEEDBACK_PRECOMPUTE:
+        return await assemble_feedback(conversation, language)
+    return await generate_feedback(conversation, language)
+
+
+@job_handler("conversation_feedback")
+def conversation_feedback_job(job, payload):
+    """Generate and store the closing feedback for a rehearsal (runs in worker.py)."""
+    conversation_id = payload["conversation_id"]
+    existing_feedback = Feedback.query.filter_by(conversation_id=conversation_id).first()
+    if existing_feedback:
+        return {"feedback": existing_feedback.content}
+
+    conversation = Conversation.query.get(conversation_id)
+    if not conversation:
+        raise ValueError(f"No conversation found with ID {conversation_id}")
+
+    expected = payload.get("message_count")
+    if expected:
+        saved = Message.query.filter_by(conversation_id=conversation_id).count()
+        if saved < expected:
+            if time.time() - payload.get("closed_at", 0) < FEEDBACK_MESSAGE_WAIT:
+                job.report(0.05, "Waiting for the last messages")
+                raise RetryLater(1, f"{saved} of {expected} messages saved")
+            logging.warning(f"Feedback for conversation {conversation_id} covers {saved} of {expected} messages")
+
+    job.report(0.1, "Generating feedback")
+    feedback_content = asyncio.run(build_conversation_feedback(conversation, payload.get("language", "Hindi")))
+    db.session.add(Feedback(conversation_id=conversation_id, content=feedback_content))
+    db.session.commit()
+    return {"feedback": feedback_content}
+
+
+async def close_conversation(app, conversation_id, language=None):
     conversation = Conversation.query.get(conversation_id)
     if not conversation:
         app.logger.error("No conversation found with the given ID: %s", conversation_id)
@@ -210,7 +601,7 @@ async def close_conversation(app, conversation_id):
         return existing_feedback.content  # Return the existing feedback if it exists
 
     try:
-        feedback_content = await generate_feedback(conversation)
+        feedback_content = await build_conversation_feedback(conversation, language)
         feedback = Feedback(conversation_id=conversation_id, content=feedback_content)
         db.session.add(feedback)
         db.session.commit()
@@ -222,21 +613,84 @@ async def close_conversation(app, conversation_id):
         return f"An error occurred while closing the conversation: {str(e)}"
 
 
-def get_past_conversations(user_id):
-    conversations = Conversation.query.filter_by(user_id=user_id).all()
-    past_conversations = []
+def first_feedback_content(convo):
+    # Conversations normally have one Feedback row; older data may have several, so keep the first saved
+    feedback = min(convo.feedback, key=lambda f: f.id, default=None)
+    return feedback.content if feedback else 'No feedback available'
+
+
+def serialize_messages(convo):
+    return [{'sender': msg.sender, 'content': msg.content, 'timestamp': msg.timestamp}
+            for msg in sorted(convo.messages, key=lambda m: m.id)]
 
-    for convo in conversations:
-        feedback = Feedback.query.filter_by(conversation_id=convo.id).first()
-        past_conversations.append({
+
+def get_past_conversations(user_id):
+    # Unpaged: the conversations, then one selectin load each for messages and feedback, however many there are
+    conversations = (Conversation.query
+                     .filter_by(user_id=user_id)
+                     .options(selectinload(Conversation.messages), selectinload(Conversation.feedback))
+                     .order_by(Conversation.id)
+                     .all())
+    return [{
+        'conversation_id': convo.id,
+        'persona': convo.persona,
+        'created_at': convo.created_at,
+        'messages': serialize_messages(convo),
+        'feedback': first_feedback_content(convo)
+    } for convo in conversations]
+
+
+def list_past_conversations(user_id, limit=None, cursor=None):
+    """One page of conversation summaries, newest first.
+
+    `cursor` is the `next_cursor` of the previous page (the last conversation id
+    returned); ids only grow, so `id < cursor` is a stable keyset even while new
+    conversations are being created. A page costs two queries: conversations
+    with their message counts, then the selectin load of their feedback.
+    """
+    limit = max(1, min(limit or PAST_CONVERSATIONS_PAGE_SIZE, PAST_CONVERSATIONS_MAX_PAGE_SIZE))
+    # Correlated, so only the page's conversations are counted (via the conversation_id index)
+    message_count = (select(func.count(Message.id))
+                     .where(Message.conversation_id == Conversation.id)
+                     .correlate(Conversation)
+                     .scalar_subquery())
+    query = (db.session.query(Conversation, message_count)
+             .filter(Conversation.user_id == user_id)
+             .options(selectinload(Conversation.feedback)))
+    if cursor is not None:
+        query = query.filter(Conversation.id < cursor)
+    # Fetch one extra row to know whether there is another page
+    rows = query.order_by(Conversation.id.desc()).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'conversations': [{
             'conversation_id': convo.id,
             'persona': convo.persona,
             'created_at': convo.created_at,
-            'messages': [{'sender': msg.sender, 'content': msg.content, 'timestamp': msg.timestamp} for msg in convo.messages],
-            'feedback': feedback.content if feedback else 'No feedback available'
-        })
-
-    return past_conversations
+            'message_count': message_count,
+            'feedback': first_feedback_content(convo)
+        } for convo, message_count in rows],
+        'next_cursor': rows[-1][0].id if has_more else None
+    }
+
+
+def get_conversation_detail(user_id, conversation_id):
+    """A single conversation with its messages and feedback, or None if the user does not own it."""
+    convo = (Conversation.query
+             .filter_by(id=conversation_id, user_id=user_id)
+             .options(selectinload(Conversation.messages), selectinload(Conversation.feedback))
+             .first())
+    if convo is None:
+        return None
+    return {
+        'conversation_id': convo.id,
+        'persona': convo.persona,
+        'created_at': convo.created_at,
+        'messages': serialize_messages(convo),
+        'feedback': first_feedback_content(convo)
+    }
 
 
 #--------------------------------------------------------------------------------------
@@ -249,9 +703,7 @@ def start_refer_conversation(user_id, product_id):
     return conversation.id
 
 def add_refer_message(conversation_id, sender, content):
-    message = ReferMessage(conversation_id=conversation_id, sender=sender, content=content)
-    db.session.add(message)
-    db.session.commit()
+    return store_message(ReferMessage, conversation_id=conversation_id, sender=sender, content=content)
 
 
 async def generate_refer_feedback(conversation):
@@ -3,6 +3,11 @@ from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 from flask_mail import Mail
 from authlib.integrations.flask_client import OAuth
+from flask_migrate import Migrate
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import sqlite3
+import os
 
 
 # Initialize extensions
@@ -11,3 +16,24 @@ login_manager = LoginManager()
 csrf = CSRFProtect()
 mail = Mail()
 oauth = OAuth()
+migrate = Migrate(render_as_batch=True)  # Batch mode lets migrations alter SQLite tables
+
+# SQLite tuning applied to every new connection. WAL lets readers proceed while a
+# writer commits, and busy_timeout makes writers from other gunicorn workers and
+# worker.py wait for the lock instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),  # Safe with WAL; fsyncs at checkpoints only
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 15000)),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+}
+
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
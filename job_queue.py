@@ -0,0 +1,232 @@
+# job_queue.py
+# Durable SQLite-backed queue for long-running LLM and ingestion work.
+# Web workers enqueue jobs and return immediately; `python worker.py` runs them.
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import Blueprint, jsonify, url_for, current_app
+from flask_login import login_required, current_user
+from sqlalchemy import update, or_, and_
+from extensions import db
+from models import Job
+
+jobs_bp = Blueprint("jobs", __name__, url_prefix="/jobs")
+
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1))  # Seconds between polls when the queue is empty
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_RETRY_BASE_DELAY = float(os.getenv("JOB_RETRY_BASE_DELAY", 5))  # Seconds; doubles on every retry
+JOB_LEASE_TIMEOUT = float(os.getenv("JOB_LEASE_TIMEOUT", 10 * 60))  # Running jobs without a heartbeat for this long are requeued
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", JOB_LEASE_TIMEOUT / 4))  # Seconds between lease renewals
+
+# Job kind -> handler(job_context, payload) returning a JSON-serializable result
+JOB_HANDLERS = {}
+
+
+class RetryLater(Exception):
+    """Raised by a handler whose input is not ready yet: the job is queued again
+    after `delay` seconds, and the attempt does not count towards max_attempts."""
+
+    def __init__(self, delay, reason="not ready"):
+        super().__init__(reason)
+        self.delay = delay
+
+
+def job_handler(kind):
+    """Register a function as the handler for a job kind."""
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue_job(kind, payload, key=None, user_id=None, max_attempts=None, requeue_finished=False, delay=0):
+    """Queue a job and return it.
+
+    Jobs with an idempotency key are only queued once: enqueueing the same key
+    again returns the existing job, unless that job failed (or succeeded, with
+    requeue_finished=True), in which case it is queued again. The job becomes
+    runnable `delay` seconds from now.
+    """
+    run_at = datetime.utcnow() + timedelta(seconds=delay)
+    if key:
+        job = Job.query.filter_by(key=key).first()
+        if job and (job.status in ("queued", "running") or (job.status == "succeeded" and not requeue_finished)):
+            return job
+        if job:
+            job.status = "queued"
+            job.payload = json.dumps(payload)
+            job.attempts = 0
+            job.error = None
+            job.progress = 0
+            job.progress_message = None
+            job.run_at = run_at
+            job.updated_at = datetime.utcnow()
+            db.session.commit()
+            return job
+
+    job = Job(
+        kind=kind,
+        key=key,
+        payload=json.dumps(payload),
+        user_id=user_id,
+        max_attempts=max_attempts or JOB_MAX_ATTEMPTS,
+        run_at=run_at,
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def job_status(job):
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress,
+        "progress_message": job.progress_message,
+        "attempts": job.attempts,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error if job.status == "failed" else None,
+        "status_url": url_for("jobs.get_job", job_id=job.id),
+    }
+
+
+class JobContext:
+    """Handed to job handlers so they can report progress (which also renews the lease)."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def report(self, progress, message=None):
+        db.session.execute(
+            update(Job)
+            .where(Job.id == self.job_id)
+            .values(progress=progress, progress_message=message, updated_at=datetime.utcnow())
+        )
+        db.session.commit()
+
+
+def claim_next_job(worker_name):
+    """Atomically move the oldest runnable job to 'running' and return it (or None)."""
+    now = datetime.utcnow()
+    lease_expired = now - timedelta(seconds=JOB_LEASE_TIMEOUT)
+    runnable = or_(
+        and_(Job.status == "queued", Job.run_at <= now),
+        and_(Job.status == "running", Job.updated_at < lease_expired),  # Worker died mid-job
+    )
+    candidate = Job.query.filter(runnable).order_by(Job.run_at, Job.id).first()
+    if not candidate:
+        return None
+
+    claimed = db.session.execute(
+        update(Job)
+        .where(Job.id == candidate.id, runnable)
+        .values(status="running", worker=worker_name, attempts=Job.attempts + 1, updated_at=now)
+    )
+    db.session.commit()
+    if claimed.rowcount != 1:
+        return None  # Another worker got there first
+    return db.session.get(Job, candidate.id)
+
+
+def renew_lease(job_id):
+    db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == "running")
+        .values(updated_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+
+@contextmanager
+def lease_heartbeat(app, job_id):
+    """Renew a running job's lease from a background thread, so one long LLM or
+    embedding call without progress reports cannot outlive it."""
+    stopped = threading.Event()
+
+    def beat():
+        while not stopped.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                with app.app_context():
+                    renew_lease(job_id)
+            except Exception as e:
+                logging.error(f"Could not renew the lease of job {job_id}: {e}")
+
+    thread = threading.Thread(target=beat, name=f"job-heartbeat-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def run_job(job):
+    handler = JOB_HANDLERS.get(job.kind)
+    job_id = job.id
+    try:
+        if handler is None:
+            raise ValueError(f"No handler registered for job kind '{job.kind}'")
+        started = time.perf_counter()
+        with lease_heartbeat(current_app._get_current_object(), job_id):
+            result = handler(JobContext(job_id), json.loads(job.payload))
+        job = db.session.get(Job, job_id)
+        job.status = "succeeded"
+        job.progress = 1
+        job.result = json.dumps(result, ensure_ascii=False, default=str)
+        job.updated_at = datetime.utcnow()
+        db.session.commit()
+        logging.info(f"Job {job_id} ({job.kind}) succeeded in {time.perf_counter() - started:.2f}s")
+    except RetryLater as e:
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        job.status = "queued"
+        job.attempts -= 1
+        job.run_at = datetime.utcnow() + timedelta(seconds=e.delay)
+        job.updated_at = datetime.utcnow()
+        db.session.commit()
+        logging.debug(f"Job {job_id} ({job.kind}) postponed {e.delay:.0f}s: {e}")
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        job.error = f"{e}\n{traceback.format_exc()}"
+        job.updated_at = datetime.utcnow()
+        if job.attempts < job.max_attempts:
+            delay = JOB_RETRY_BASE_DELAY * 2 ** (job.attempts - 1)
+            job.status = "queued"
+            job.run_at = datetime.utcnow() + timedelta(seconds=delay)
+            logging.warning(f"Job {job_id} ({job.kind}) failed on attempt {job.attempts}, retrying in {delay:.0f}s: {e}")
+        else:
+            job.status = "failed"
+            logging.error(f"Job {job_id} ({job.kind}) failed after {job.attempts} attempts: {e}")
+        db.session.commit()
+
+
+def run_worker(app, once=False):
+    """Process jobs until interrupted (or until the queue is empty with once=True)."""
+    worker_name = f"{socket.gethostname()}:{os.getpid()}"
+    logging.info(f"Job worker {worker_name} started with handlers: {sorted(JOB_HANDLERS)}")
+    while True:
+        with app.app_context():
+            job = claim_next_job(worker_name)
+            if job:
+                run_job(job)
+                continue
+        if once:
+            return
+        time.sleep(JOB_POLL_INTERVAL)
+
+
+@jobs_bp.route("/<int:job_id>", methods=["GET"])
+@login_required
+def get_job(job_id):
+    job = db.session.get(Job, job_id)
+    if not job or (job.user_id is not None and job.user_id != current_user.id):
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_status(job))
@@ -1,5 +1,4 @@
-from flask import Blueprint, render_template, request, jsonify
-from PyPDF2 import PdfReader
+from flask import Blueprint, render_template, request, jsonify, current_app
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import os
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
@@ -10,10 +9,11 @@ from langchain.chains.question_answering import load_qa_chain
 from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
 from flask_login import login_required, current_user
-import camelot
-from pytesseract import image_to_string
-import pdf2image
 import re
+import hashlib
+from job_queue import job_handler, enqueue_job, job_status
+from vector_index import resident_index
+from pdf_ingestion import extract_documents
 
 knowledge_bp = Blueprint("recall", __name__, url_prefix="/recall")
 
@@ -21,62 +21,14 @@ load_dotenv()
 os.getenv("GOOGLE_API_KEY")
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
-# For image text extraction (OCR)
-def extract_text_from_images(pdf_path):
-    images = pdf2image.convert_from_path(pdf_path)  # Convert each page of PDF into images
-    ocr_text = ""
-    for i, img in enumerate(images):
-        print(f"Processing image {i + 1}...")
+def get_pdf_text(pdf_paths, on_page=None):
+    # Page-level extraction in a process pool; see pdf_ingestion
+    return "\n".join(text for _, text, _ in extract_documents(pdf_paths, on_page=on_page))
 
-        # Example: Convert the image to grayscale using PIL.Image
-        img = img.convert('L')  # 'L' mode is for grayscale
 
-        # Perform OCR on the processed image
-        text = image_to_string(img)
-        ocr_text += text + "\n"
-        print(f"OCR Text from image {i + 1}:\n{text}\n")
-    return ocr_text
-
-# For table extraction
-def extract_tables_from_pdf(pdf_path):
-    try:
-        tables = camelot.read_pdf(pdf_path, pages='all', flavor='stream', strip_text='\n')
-        table_text = ""
-
-        for i, table in enumerate(tables):
-            print(f"Extracting table {i + 1} of {len(tables)}...")
-            table_data = table.df.to_string(index=False)
-            table_text += f"\n--- Table {i + 1} ---\n" + table_data + "\n"
-            print(f"Extracted Table {i + 1}:\n{table_data}\n")
-
-        print(f"Total {len(tables)} tables extracted.")
-        return table_text
-    except Exception as e:
-        print(f"Error extracting tables: {e}")
-        return ""
-
-
-
-def get_pdf_text(pdf_docs):
-    text = ""
-    for pdf in pdf_docs:
-        try:
-            pdf_reader = PdfReader(pdf)
-            for page_num, page in enumerate(pdf_reader.pages, start=1):
-                page_text = page.extract_text()  # Extract main text from PDF
-                text += page_text
-                print(f"Extracted text from page {page_num}:\n{page_text}\n")
-
-            # Extract tables and images
-            table_text = extract_tables_from_pdf(pdf)
-            image_text = extract_text_from_images(pdf)
-
-            # Combine all extracted content
-            text += "\n" + table_text + "\n" + image_text
-
-        except Exception as e:
-            print(f"Error reading PDF file: {e}")
-    return text
+def document_id(path):
+    # Uploads are stored under their content hash, which identifies the document in the index
+    return os.path.splitext(os.path.basename(path))[0]
 
 
 def get_text_chunks(text):
@@ -85,10 +37,9 @@ def get_text_chunks(text):
     return chunks
 
 
-def get_vector_store(text_chunks):
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-    vector_store = FAISS.from_texts(text_chunks, embedding=embeddings)
-    vector_store.save_local("faiss_index")
+def get_vector_store(path, name, text_chunks):
+    # Only chunks not already in the index are embedded; web workers pick up the new version on their next question
+    return resident_index.add_document(document_id(path), name, text_chunks)
 
 
 def get_conversational_chain():
@@ -122,21 +73,101 @@ def render_knowledge_page():
     return render_template("recall.html")
 
 
+@job_handler("document_ingestion")
+def document_ingestion_job(job, payload):
+    """Extract, chunk and index uploaded PDFs that are not indexed yet (runs in worker.py)."""
+    paths = payload["paths"]
+    names = dict(zip(paths, payload.get("names", [])))
+    indexed = resident_index.documents()
+    pending = [path for path in paths if document_id(path) not in indexed]
+
+    job.report(0.05, "Extracting text")
+    documents = extract_documents(pending, on_page=lambda done, total: job.report(0.05 + 0.55 * done / total, f"Extracted page {done} of {total}"))
+    chunks = added = 0
+    for number, (path, text, _) in enumerate(documents, start=1):
+        text_chunks = get_text_chunks(text)
+        chunks += len(text_chunks)
+        job.report(0.6 + 0.4 * (number - 1) / len(documents), f"Embedding {len(text_chunks)} chunks")
+        added += get_vector_store(path, names.get(path, os.path.basename(path)), text_chunks)
+
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+    return {
+        "message": "Document uploaded...",
+        "documents": payload.get("names", []),
+        "skipped": len(paths) - len(pending),
+        "chunks": chunks,
+        "embedded": added,
+    }
+
+
+@job_handler("document_removal")
+def document_removal_job(job, payload):
+    """Remove one document's vectors from the index (runs in worker.py)."""
+    removed = resident_index.remove_document(payload["document"])
+    if removed is None:
+        return {"message": "Document not found in the index."}
+    return {"message": "Document removed.", "chunks": removed}
+
+
 @knowledge_bp.route("/upload", methods=["POST"])
 @login_required
 def upload_document():
     pdf_docs = request.files.getlist("pdf_docs")
     if pdf_docs:
         print(pdf_docs)
-        raw_text = get_pdf_text(pdf_docs)
-        text_chunks = get_text_chunks(raw_text)
-        get_vector_store(text_chunks)
-        message = "Document uploaded..."
-        return jsonify(message=message)
+        # Store the uploads under their content hash and let worker.py do the ingestion
+        upload_dir = os.path.join(current_app.instance_path, "uploads")
+        os.makedirs(upload_dir, exist_ok=True)
+        paths, digests = [], []
+        for pdf in pdf_docs:
+            data = pdf.read()
+            digest = hashlib.sha256(data).hexdigest()
+            path = os.path.join(upload_dir, digest + ".pdf")
+            if not os.path.exists(path):
+                with open(path, "wb") as f:
+                    f.write(data)
+            paths.append(path)
+            digests.append(digest)
+
+        job = enqueue_job(
+            "document_ingestion",
+            {"paths": paths, "names": [pdf.filename for pdf in pdf_docs]},
+            key="document_ingestion:" + hashlib.sha256("".join(sorted(digests)).encode()).hexdigest(),
+            user_id=current_user.id,
+            requeue_finished=True  # Re-run so a removed document can be uploaded again; indexed ones are skipped
+        )
+        return jsonify(message="Document queued for processing...", **job_status(job)), 202
     else:
         return jsonify(message="No PDF files uploaded.")
 
 
+@knowledge_bp.route("/documents", methods=["GET"])
+@login_required
+def list_documents():
+    documents = [
+        {"id": doc_id, "name": entry["name"], "chunks": len(entry["chunks"]), "added_at": entry["added_at"]}
+        for doc_id, entry in resident_index.documents().items()
+    ]
+    return jsonify(documents=documents)
+
+
+@knowledge_bp.route("/documents/<digest>", methods=["DELETE"])
+@login_required
+def delete_document(digest):
+    if not current_user.is_admin:
+        return jsonify(message="Access denied."), 403
+    job = enqueue_job(
+        "document_removal",
+        {"document": digest},
+        key="document_removal:" + digest,
+        user_id=current_user.id,
+        requeue_finished=True  # The same document can be uploaded and removed again
+    )
+    return jsonify(message="Document removal queued...", **job_status(job)), 202
+
+
 @knowledge_bp.route("/ask", methods=["POST"])
 def ask_question():
     try:
@@ -153,12 +184,8 @@ def ask_question():
 
 
 def user_input(user_question):
-    # Load embeddings and FAISS index
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-    new_db = FAISS.load_local("faiss_index", embeddings, allow_dangerous_deserialization=True)
-
-    # Perform similarity search to get relevant documents
-    docs = new_db.similarity_search(user_question)
+    # Perform similarity search on the in-memory FAISS index to get relevant documents
+    docs = resident_index.similarity_search(user_question)
 
     # Combine document contents into a single context string
     context_parts = []
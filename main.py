@@ -1,14 +1,15 @@
 import os
 import uuid
 import asyncio
-from flask import Flask, request, render_template, jsonify, send_from_directory, redirect, url_for, session
+from flask import Flask, request, render_template, jsonify, send_from_directory, redirect, url_for, session, Response, stream_with_context
 from flask_session import Session
 from flask_login import login_required, current_user
 from datetime import timedelta
-from conversation_service import start_conversation, add_message, close_conversation, get_past_conversations
+from conversation_service import start_conversation, add_message, close_conversation, get_past_conversations, list_past_conversations, get_conversation_detail
 import re
 from flask_wtf.csrf import CSRFProtect, generate_csrf
 import random
+import time
 from langchain_community.vectorstores import FAISS
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from gtts import gTTS
@@ -16,6 +17,7 @@ import google.generativeai as genai
 from dotenv import load_dotenv
 import json
 import glob
+import queue
 import csv
 from knowledge import knowledge_bp
 from reflect import reflect_bp
@@ -38,7 +40,12 @@ from auth import auth_bp, init_auth
 from admin import admin_bp
 from authlib.integrations.flask_client import OAuth
 from models import User, Conversation, Message, Feedback, Persona, ReferConversation, Product
-from extensions import login_manager, csrf, mail, oauth, db
+from extensions import login_manager, csrf, mail, oauth, db, migrate
+from job_queue import jobs_bp, enqueue_job, job_status
+from metrics import init_metrics
+from session_store import init_session, SESSION_BACKEND
+from message_store import message_buffer, flush_messages, unit_of_work, MESSAGE_WRITE_BEHIND, MESSAGE_BUFFER_MAX_DELAY
+from tts_service import speech_url, start_pool_prewarm, tts_bp, VOICE_MAPPING, AUDIO_EXTENSIONS
 
 
 
@@ -55,11 +62,8 @@ llm = ChatGoogleGenerativeAI(model="gemini-pro", convert_system_message_to_human
 #llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", convert_system_message_to_human=True)
 #env = os.getenv('FLASK_ENV', 'development')
 executor = ThreadPoolExecutor()
-# Define voice mappings for male and female personas
-VOICE_MAPPING = {
-    "Male": "hi-IN-MadhurNeural",
-    "Female": "hi-IN-SwaraNeural"
-}
+# Speech pool prewarm and the metrics sampler; worker.py turns them off since it serves no requests
+BACKGROUND_SERVICES = os.getenv("BACKGROUND_SERVICES", "true").lower() == "true"
 
 app = Flask(__name__)
 #env = os.getenv('FLASK_ENV', 'development')
@@ -68,7 +72,7 @@ app.config['WTF_CSRF_ENABLED'] = True  # Enable CSRF protection
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db.sqlite'
 
-# Configure server-side session
+# Configure server-side session (SESSION_BACKEND=sqlite switches to session_store.py)
 app.config['SESSION_TYPE'] = 'filesystem'  # Use the filesystem to store sessions
 app.config['SESSION_FILE_DIR'] = './flask_session/'  # Directory to store session files
 
@@ -100,12 +104,22 @@ oauth.register(
 
 # Initialize extensions
 db.init_app(app)
+migrate.init_app(app, db)  # `flask --app main db upgrade` applies migrations/ (indexes on existing databases)
 login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
 csrf.init_app(app)
 mail.init_app(app)
 oauth.init_app(app)
-Session(app)  # Initialize the session
+if SESSION_BACKEND == 'sqlite':
+    init_session(app)  # SQLite store shared by all workers, written only when the session changes
+else:
+    Session(app)  # Initialize the session
+if MESSAGE_WRITE_BEHIND:
+    message_buffer.start(app)  # Background flushing of buffered chat messages
+with app.app_context():
+    db.create_all()  # Create tables added since the database was set up (e.g. background feedback)
+if BACKGROUND_SERVICES:
+    start_pool_prewarm()  # Pre-connect pooled Azure speech synthesizers
 # Initialize auth module
 init_auth(oauth)
 
@@ -117,6 +131,9 @@ app.register_blueprint(reflect_bp, url_prefix='/reflect')
 app.register_blueprint(auth_bp)
 app.register_blueprint(admin_bp, url_prefix='/admin')
 app.register_blueprint(analytics_bp)
+app.register_blueprint(tts_bp)
+app.register_blueprint(jobs_bp)
+init_metrics(app, sample_system=BACKGROUND_SERVICES)  # Background system sampler, request timing and /metrics
 
 
 logging.basicConfig(
@@ -290,6 +307,24 @@ def get_past_conversations_route():
     return jsonify(past_conversations)
 
 
+@app.route('/conversations', methods=['GET'])
+@login_required
+def list_conversations_route():
+    # Cursor-paginated summaries; pass back `next_cursor` as ?cursor= for the next page
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor', type=int)
+    return jsonify(list_past_conversations(current_user.id, limit=limit, cursor=cursor))
+
+
+@app.route('/conversations/<int:conversation_id>', methods=['GET'])
+@login_required
+def conversation_detail_route(conversation_id):
+    conversation = get_conversation_detail(current_user.id, conversation_id)
+    if conversation is None:
+        return jsonify({'error': 'Conversation not found'}), 404
+    return jsonify(conversation)
+
+
 
 @app.route('/save_feedback', methods=['POST'])
 @login_required
@@ -438,6 +473,33 @@ def chat1():
 logging.basicConfig(level=logging.INFO)
 
 
+def build_persona_messages(persona_name, persona_info, tone, language, agent_message):
+    language_instruction = "YOU HAVE A CONVERSATION IN HINDI." if language == 'Hindi' else "YOU HAVE A CONVERSATION IN ENGLISH."
+
+    return [
+        SystemMessage(
+            content=f"""
+                CONTEXT: AN INSURANCE AGENT HAS APPROACHED YOU FOR THE FIRST TIME TO SELL AN INSURANCE POLICY.
+
+                YOUR ROLE:
+                - ACT AS A POTENTIAL CUSTOMER.
+                - FOCUS ON YOUR ROLE AS THE CUSTOMER AND MAINTAIN A CONSISTENT PERSONA THROUGHOUT THE CONVERSATION.
+                - YOUR PROFILE: "{persona_name}" AND "{persona_info}".
+                - YOUR TONE: "{tone.upper()}".
+                - ANSWER ONLY TO WHAT HAS BEEN ASKED RELATED TO CONTEXT.
+                - YOU KNOW HINDI AND ENGLISH VERY WELL. {language_instruction}
+                - REMEMBER, TAKE A DEEP BREATH AND THINK TWICE BEFORE RESPONDING.
+                - KEEP THE CONTEXT OF THE CURRENT CONVERSATION IN MIND AND TAKE IT TOWARDS A POSITIVE END STEP BY STEP BY RESPONDING TO EACH QUERY ONE BY ONE.
+                - AVOID RESPONDING AS THE AGENT OR PRODUCING A COMPLETE SCRIPT.
+                - KEEP RESPONSES CONCISE AND LIMITED TO A MAXIMUM OF TWO SENTENCES.
+
+                THIS IS VERY IMPORTANT FOR MY CAREER.
+                """
+        ),
+        HumanMessage(content=agent_message),
+    ]
+
+
 @app.route('/start_conversation/<persona_name>', methods=['POST'])
 @login_required
 async def start_conversation1(persona_name):
@@ -462,8 +524,6 @@ async def start_conversation1(persona_name):
     session['language'] = language
     print(f"Received tone: {tone}")
 
-    audio_file_name = str(uuid.uuid4()) + ".mp3"
-
     # Convert both persona name from the request and the stored name to lowercase
     persona = Persona.query.filter(func.lower(Persona.name) == persona_name.lower(),
                                    Persona.user_id == current_user.id).first()
@@ -494,58 +554,200 @@ async def start_conversation1(persona_name):
     print(f"Selected voice: {selected_voice}")
     print("Tone:", tone)
 
-    language_instruction = "YOU HAVE A CONVERSATION IN HINDI." if language == 'Hindi' else "YOU HAVE A CONVERSATION IN ENGLISH."
-
-    message2 = [
-        SystemMessage(
-            content=f"""
-                CONTEXT: AN INSURANCE AGENT HAS APPROACHED YOU FOR THE FIRST TIME TO SELL AN INSURANCE POLICY.
-
-                YOUR ROLE:
-                - ACT AS A POTENTIAL CUSTOMER.
-                - FOCUS ON YOUR ROLE AS THE CUSTOMER AND MAINTAIN A CONSISTENT PERSONA THROUGHOUT THE CONVERSATION.
-                - YOUR PROFILE: "{persona_name}" AND "{persona_info}".
-                - YOUR TONE: "{tone.upper()}".
-                - ANSWER ONLY TO WHAT HAS BEEN ASKED RELATED TO CONTEXT.
-                - YOU KNOW HINDI AND ENGLISH VERY WELL. {language_instruction}
-                - REMEMBER, TAKE A DEEP BREATH AND THINK TWICE BEFORE RESPONDING.
-                - KEEP THE CONTEXT OF THE CURRENT CONVERSATION IN MIND AND TAKE IT TOWARDS A POSITIVE END STEP BY STEP BY RESPONDING TO EACH QUERY ONE BY ONE.
-                - AVOID RESPONDING AS THE AGENT OR PRODUCING A COMPLETE SCRIPT.
-                - KEEP RESPONSES CONCISE AND LIMITED TO A MAXIMUM OF TWO SENTENCES.
-
-                THIS IS VERY IMPORTANT FOR MY CAREER.
-                """
-        ),
-        HumanMessage(content=agent_message),
-    ]
+    message2 = build_persona_messages(persona_name, persona_info, tone, language, agent_message)
 
     response = await asyncio.to_thread(llm.invoke, message2)
     customer_message = response.content
     print("Customer response: ", customer_message)
 
-    # Azure Text-to-Speech implementation
-    speech_config = speechsdk.SpeechConfig(subscription=azure_subscription_key, region=azure_region)
-    speech_config.speech_synthesis_voice_name = selected_voice
-
-    audio_config = speechsdk.audio.AudioOutputConfig(filename=f"static/{audio_file_name}")
-    speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=audio_config)
-
-    result = await asyncio.to_thread(speech_synthesizer.speak_text_async(customer_message).get)
-    if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-        print(f"Speech synthesized for text [{customer_message}]")
-    elif result.reason == speechsdk.ResultReason.Canceled:
-        cancellation_details = result.cancellation_details
-        print(f"Speech synthesis canceled: {cancellation_details.reason}")
-        if cancellation_details.reason == speechsdk.CancellationReason.Error:
-            print(f"Error details: {cancellation_details.error_details}")
+    # With "persist", both sides of the turn are saved here in one transaction
+    # instead of the client posting each one to /add_message
+    message_ids = None
+    if request.json.get('persist') and agent_message:
+        with unit_of_work():
+            saved_agent_message = add_message(conversation_id, 'user', agent_message)
+            saved_reply = add_message(conversation_id, 'system', customer_message)
+        # Ids are None when messages are buffered for write-behind
+        message_ids = {
+            "agent": saved_agent_message.id if saved_agent_message else None,
+            "reply": saved_reply.id if saved_reply else None
+        }
+
+    # Azure Text-to-Speech: a cached file or a URL that streams the synthesizer output
+    audio_url = await asyncio.to_thread(speech_url, customer_message, selected_voice, language)
+    print(f"Audio for text [{customer_message}]: {audio_url}")
 
     return jsonify({
         "text": customer_message,
-        "audio": f"/static/{audio_file_name}",
-        "conversation_id": conversation_id
+        "audio": audio_url,
+        "conversation_id": conversation_id,
+        "message_ids": message_ids
     })
 
 
+# Sentence boundaries for incremental TTS: English punctuation and the Hindi danda
+SENTENCE_END_PATTERN = re.compile(r'(?<=[.!?।])\s+')
+
+
+def split_complete_sentences(buffer):
+    """Split finished sentences off a streaming text buffer.
+
+    Returns (sentences, remainder) where remainder is the trailing text that
+    has not been closed by a sentence terminator yet.
+    """
+    parts = SENTENCE_END_PATTERN.split(buffer)
+    remainder = parts.pop()
+    sentences = [part.strip() for part in parts if part.strip()]
+    return sentences, remainder
+
+
+def stream_persona_reply(messages, voice, language):
+    """Yield (event, payload) pairs while the persona reply is being generated.
+
+    Tokens are yielded as soon as Gemini produces them. Every finished sentence is
+    handed to the TTS executor immediately, and its audio segment is yielded (in
+    sentence order) as soon as it is ready, so playback can start long before the
+    full reply has been generated or synthesized.
+    """
+    events = queue.Queue()
+
+    def produce_tokens():
+        try:
+            for chunk in llm.stream(messages):
+                if chunk.content:
+                    events.put(("token", chunk.content))
+        except Exception as e:
+            events.put(("error", str(e)))
+        events.put(("llm_done", None))
+
+    executor.submit(produce_tokens)
+
+    sentences = []
+    segments = []
+    buffer = ""
+    next_segment = 0
+    llm_done = False
+
+    def submit_sentence(sentence):
+        future = executor.submit(speech_url, sentence, voice, language)
+        future.add_done_callback(lambda _: events.put(("segment_ready", None)))
+        sentences.append(sentence)
+        segments.append(future)
+
+    while not llm_done or next_segment < len(segments):
+        event, payload = events.get()
+
+        if event == "token":
+            yield "token", payload
+            buffer += payload
+            finished, buffer = split_complete_sentences(buffer)
+            for sentence in finished:
+                submit_sentence(sentence)
+        elif event == "error":
+            logging.error(f"Error while streaming persona reply: {payload}")
+            yield "error", payload
+        elif event == "llm_done":
+            llm_done = True
+            if buffer.strip():
+                submit_sentence(buffer.strip())
+                buffer = ""
+
+        # Emit every audio segment that is ready, keeping sentence order
+        while next_segment < len(segments) and segments[next_segment].done():
+            try:
+                audio_url = segments[next_segment].result()
+            except Exception as e:
+                logging.error(f"Error synthesizing sentence {next_segment}: {e}")
+                audio_url = None
+            yield "audio", {
+                "index": next_segment,
+                "text": sentences[next_segment],
+                "audio": audio_url
+            }
+            next_segment += 1
+
+
+@app.route('/start_conversation_stream/<persona_name>', methods=['POST'])
+@login_required
+def start_conversation_stream(persona_name):
+    """Streaming variant of /start_conversation.
+
+    Responds with newline-delimited JSON events:
+    {"type": "start"}, {"type": "token"} per text chunk, {"type": "audio"} per
+    synthesized sentence and a final {"type": "done"} with the full reply text.
+    With "persist", both sides of the turn are saved once the reply is complete,
+    as in /start_conversation, and "done" carries their message_ids.
+    """
+    persona_name = persona_name.strip().lower()
+
+    conversation_id = session.get('conversation_id')
+    if not conversation_id:
+        conversation_id = start_conversation(current_user.id, persona_name)
+        session['conversation_id'] = conversation_id
+        session.modified = True
+
+    agent_message = request.json.get('message')
+    persist = request.json.get('persist') and agent_message
+    tone = request.json.get('tone', session.get('tone', 'polite'))
+    language = request.json.get('language', session.get('language', 'Hindi'))
+    session['language'] = language
+
+    persona = Persona.query.filter(func.lower(Persona.name) == persona_name,
+                                   Persona.user_id == current_user.id).first()
+    if not persona:
+        return jsonify({"error": "Persona not found"}), 404
+
+    persona_info = {
+        "Name": persona.name,
+        "Age": persona.age,
+        "Gender": persona.gender,
+        "Occupation": persona.occupation,
+        "Marital Status": persona.marital_status,
+        "Dependent Family Members": persona.dependent_family_members,
+        "Financial Goals": persona.financial_goals,
+        "Category": persona.category
+    }
+    selected_voice = VOICE_MAPPING.get(persona.gender, "hi-IN-SwaraNeural")
+    messages = build_persona_messages(persona_name, persona_info, tone, language, agent_message)
+
+    def generate():
+        reply_parts = []
+        failed = False
+        yield json.dumps({"type": "start", "conversation_id": conversation_id}) + "\n"
+        for event, payload in stream_persona_reply(messages, selected_voice, language):
+            if event == "token":
+                reply_parts.append(payload)
+                yield json.dumps({"type": "token", "text": payload}, ensure_ascii=False) + "\n"
+            elif event == "audio":
+                yield json.dumps({"type": "audio", **payload}, ensure_ascii=False) + "\n"
+            elif event == "error":
+                failed = True
+                yield json.dumps({"type": "error", "error": "Failed to generate the reply"}) + "\n"
+
+        customer_message = "".join(reply_parts)
+        message_ids = None
+        if persist and customer_message and not failed:
+            with unit_of_work():
+                saved_agent_message = add_message(conversation_id, 'user', agent_message)
+                saved_reply = add_message(conversation_id, 'system', customer_message)
+            # Ids are None when messages are buffered for write-behind
+            message_ids = {
+                "agent": saved_agent_message.id if saved_agent_message else None,
+                "reply": saved_reply.id if saved_reply else None
+            }
+        yield json.dumps({
+            "type": "done",
+            "text": customer_message,
+            "conversation_id": conversation_id,
+            "message_ids": message_ids
+        }, ensure_ascii=False) + "\n"
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable proxy buffering so chunks reach the browser immediately
+    return response
+
+
 @app.route('/set_tone', methods=['POST'])
 @login_required
 def set_tone():
@@ -557,6 +759,7 @@ def set_tone():
 @app.route('/add_message', methods=['POST'])
 @login_required
 def add_message_route():
+    # Kept for older clients; /start_conversation with "persist": true saves the turn itself
     try:
         data = request.json
         conversation_id = data.get('conversation_id')
@@ -585,11 +788,30 @@ def close_conversation_route():
         return jsonify({'error': 'conversation_id is required'}), 400
 
     try:
-        feedback = asyncio.run(close_conversation(app, conversation_id))
-        if feedback is None:
-            app.logger.error("Failed to retrieve feedback for conversation_id: %s", conversation_id)
-            return jsonify({'error': 'Failed to retrieve feedback'}), 500
-        return jsonify({'status': 'conversation closed', 'feedback': feedback}), 200
+        flush_messages()  # Buffered messages from this worker must be in the database before feedback runs
+        existing_feedback = Feedback.query.filter_by(conversation_id=conversation_id).first()
+        if existing_feedback:
+            return jsonify({'status': 'conversation closed', 'feedback': existing_feedback.content}), 200
+
+        if not Conversation.query.get(conversation_id):
+            return jsonify({'error': 'No conversation found with the given ID'}), 404
+
+        # Feedback is generated by worker.py; the client polls the job's status_url.
+        # The job waits until the messages the client counted are in the database:
+        # other web workers may still hold some in their write-behind buffers.
+        message_count = data.get('message_count')
+        payload = {"conversation_id": conversation_id, "language": session.get('language', 'Hindi')}
+        if isinstance(message_count, int):
+            payload.update(message_count=message_count, closed_at=time.time())
+        job = enqueue_job(
+            "conversation_feedback",
+            payload,
+            key=f"conversation_feedback:{conversation_id}",
+            user_id=current_user.id,
+            # Older clients send no count: give other workers time to flush instead
+            delay=MESSAGE_BUFFER_MAX_DELAY if MESSAGE_WRITE_BEHIND and 'message_count' not in payload else 0
+        )
+        return jsonify({'status': 'feedback queued', **job_status(job)}), 202
     except Exception as e:
         app.logger.error(f"Error in close_conversation_route for conversation_id {conversation_id}: {e}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -613,7 +835,8 @@ def clear_session():
 @app.route('/remove_all_audio_files', methods=['POST'])
 async def remove_all_audio_files():
     try:
-        audio_files = glob.glob(os.path.join("static", "*.mp3"))  # Adjust the extension if needed
+        # Only per-call files; audio in static/tts_cache/ is managed by the TTS cache
+        audio_files = [path for extension in AUDIO_EXTENSIONS for path in glob.glob(os.path.join("static", "*" + extension))]
         for file_path in audio_files:
             await asyncio.to_thread(os.remove, file_path)
         return jsonify({"message": "All audio files removed successfully"})
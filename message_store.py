@@ -0,0 +1,148 @@
+# message_store.py
+# Batched message writes: a unit of work that commits a whole chat turn at once,
+# and an optional write-behind buffer that takes message inserts off the request path.
+import os
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from flask import g
+from extensions import db
+
+# Buffer Message/ReferMessage inserts in memory and commit them in batches
+MESSAGE_WRITE_BEHIND = os.getenv("MESSAGE_WRITE_BEHIND", "false").lower() == "true"
+MESSAGE_BUFFER_MAX_ROWS = int(os.getenv("MESSAGE_BUFFER_MAX_ROWS", 50))  # Flush as soon as this many rows are waiting
+MESSAGE_BUFFER_MAX_DELAY = float(os.getenv("MESSAGE_BUFFER_MAX_DELAY", 2))  # Seconds a row may wait before it is flushed
+
+
+@contextmanager
+def unit_of_work():
+    """Commit everything saved inside the block in one transaction.
+
+    Nested blocks join the outermost one; if the block raises, nothing is
+    committed. after_commit callbacks passed to save() run after the commit.
+    """
+    depth = g.get("unit_of_work_depth", 0)
+    if depth == 0:
+        g.unit_of_work_callbacks = []
+    g.unit_of_work_depth = depth + 1
+    try:
+        yield db.session
+        if depth == 0:
+            db.session.commit()
+    except Exception:
+        if depth == 0:
+            db.session.rollback()
+        raise
+    finally:
+        g.unit_of_work_depth = depth
+    if depth == 0:
+        callbacks, g.unit_of_work_callbacks = g.unit_of_work_callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+def save(obj, after_commit=None):
+    """Add obj to the session and commit, unless inside unit_of_work() (which commits at the end)."""
+    db.session.add(obj)
+    if g.get("unit_of_work_depth"):
+        db.session.flush()  # Assign the primary key now; the commit happens when the unit of work ends
+        if after_commit:
+            g.unit_of_work_callbacks.append(after_commit)
+        return obj
+    db.session.commit()
+    if after_commit:
+        after_commit()
+    return obj
+
+
+class MessageWriteBuffer:
+    """Collects message rows in memory and inserts them in one transaction per flush.
+
+    A flush happens when MESSAGE_BUFFER_MAX_ROWS rows are waiting, every
+    MESSAGE_BUFFER_MAX_DELAY seconds, at process exit, and whenever flush() is
+    called (conversation close), which returns only once the rows are committed.
+    Buffers are per process: a close handled by another gunicorn worker can only
+    rely on this worker's rows being written within MESSAGE_BUFFER_MAX_DELAY.
+    """
+
+    def __init__(self, max_rows, max_delay):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._rows = []  # (model, fields, after_commit)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # One flush at a time keeps rows in insertion order
+        self._wake = threading.Event()
+        self._thread = None
+        self._app = None
+
+    def start(self, app):
+        self._app = app
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="message-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def add(self, model, fields, after_commit=None):
+        with self._lock:
+            self._rows.append((model, fields, after_commit))
+            full = len(self._rows) >= self.max_rows
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.max_delay)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error flushing buffered messages: {e}")
+
+    def flush(self):
+        """Commit every buffered row; returns the number written."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+            with self._app.app_context():
+                try:
+                    db.session.add_all([model(**fields) for model, fields, _ in rows])
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    with self._lock:
+                        self._rows[:0] = rows  # Keep them for the next attempt
+                    raise
+        for _, _, after_commit in rows:
+            if after_commit:
+                try:
+                    after_commit()
+                except Exception as e:
+                    logging.error(f"Error in message after_commit callback: {e}")
+        return len(rows)
+
+
+message_buffer = MessageWriteBuffer(MESSAGE_BUFFER_MAX_ROWS, MESSAGE_BUFFER_MAX_DELAY)
+
+
+def store_message(model, after_commit=None, **fields):
+    """Persist a chat message row.
+
+    With MESSAGE_WRITE_BEHIND the row is buffered and None is returned;
+    after_commit runs once it is in the database. Otherwise the row is saved
+    (inside the current unit of work, if any), after_commit runs once it is
+    committed and the model instance is returned.
+    """
+    if MESSAGE_WRITE_BEHIND:
+        message_buffer.add(model, fields, after_commit)
+        return None
+    return save(model(**fields), after_commit)
+
+
+def flush_messages():
+    """Make sure this process's buffered messages are committed (call before closing a conversation)."""
+    if MESSAGE_WRITE_BEHIND:
+        message_buffer.flush()
@@ -0,0 +1,178 @@
+# metrics.py
+# Background system sampler and Prometheus-text /metrics endpoint.
+# Metrics are per gunicorn worker; every series carries a `pid` label.
+import os
+import time
+import bisect
+import logging
+import threading
+import psutil
+from flask import Blueprint, Response, request, g, abort
+from tts_service import tts_cache, audio_stats
+
+metrics_bp = Blueprint("metrics", __name__)
+
+METRICS_SAMPLE_INTERVAL = float(os.getenv("METRICS_SAMPLE_INTERVAL", 5))  # Seconds between system samples
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # When set, /metrics requires "Authorization: Bearer <token>"
+
+# Request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class SystemSampler:
+    """Samples process RSS, CPU, open files and threads on a daemon thread.
+
+    cpu_percent() is called without an interval, so it reports usage since the
+    previous sample instead of sleeping; readers just take the latest sample.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.process = psutil.Process()
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self.process.cpu_percent(interval=None)  # Prime the CPU counter
+        self._thread = threading.Thread(target=self._run, name="metrics-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                logging.error(f"Error sampling system metrics: {e}")
+            time.sleep(self.interval)
+
+    def sample(self):
+        with self.process.oneshot():
+            memory_info = self.process.memory_info()
+            sample = {
+                "rss_bytes": memory_info.rss,
+                "vms_bytes": memory_info.vms,
+                "cpu_percent": self.process.cpu_percent(interval=None),
+                "open_files": self.process.num_fds() if hasattr(self.process, "num_fds") else len(self.process.open_files()),
+                "threads": self.process.num_threads(),
+                "timestamp": time.time(),
+            }
+        with self._lock:
+            self._latest = sample
+        return sample
+
+    def latest(self):
+        with self._lock:
+            return dict(self._latest)
+
+
+class RequestMetrics:
+    """Per-route request counters and latency histograms."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = {}  # (route, method, status) -> count
+        self.histograms = {}  # (route, method) -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, route, method, status, seconds):
+        with self._lock:
+            self.counts[(route, method, status)] = self.counts.get((route, method, status), 0) + 1
+            histogram = self.histograms.setdefault((route, method), [0] * (len(self.buckets) + 1) + [0.0])
+            histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram[-1] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts), {key: list(value) for key, value in self.histograms.items()}
+
+
+system_sampler = SystemSampler(METRICS_SAMPLE_INTERVAL)
+request_metrics = RequestMetrics(LATENCY_BUCKETS)
+
+
+def latest_system_sample():
+    """Latest system sample, taking one synchronously if the sampler has not run yet."""
+    return system_sampler.latest() or system_sampler.sample()
+
+
+def _labels(**labels):
+    labels["pid"] = os.getpid()
+    return "{" + ",".join(f'{key}="{str(value)}"' for key, value in labels.items()) + "}"
+
+
+def render_prometheus():
+    lines = []
+    sample = latest_system_sample()
+    for name, key, help_text in [
+        ("process_resident_memory_bytes", "rss_bytes", "Resident set size in bytes."),
+        ("process_virtual_memory_bytes", "vms_bytes", "Virtual memory size in bytes."),
+        ("process_cpu_percent", "cpu_percent", "CPU usage since the previous sample, in percent."),
+        ("process_open_fds", "open_files", "Number of open file descriptors."),
+        ("process_threads", "threads", "Number of OS threads."),
+    ]:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name}{_labels()} {sample.get(key, 0)}")
+
+    counts, histograms = request_metrics.snapshot()
+    lines.append("# HELP http_requests_total Requests handled, by route, method and status.")
+    lines.append("# TYPE http_requests_total counter")
+    for (route, method, status), count in sorted(counts.items()):
+        lines.append(f"http_requests_total{_labels(route=route, method=method, status=status)} {count}")
+
+    lines.append("# HELP http_request_duration_seconds Request latency, by route and method.")
+    lines.append("# TYPE http_request_duration_seconds histogram")
+    for (route, method), histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(list(LATENCY_BUCKETS) + ["+Inf"], histogram[:-1]):
+            cumulative += bucket_count
+            lines.append(f"http_request_duration_seconds_bucket{_labels(route=route, method=method, le=bound)} {cumulative}")
+        lines.append(f"http_request_duration_seconds_count{_labels(route=route, method=method)} {cumulative}")
+        lines.append(f"http_request_duration_seconds_sum{_labels(route=route, method=method)} {histogram[-1]:.6f}")
+
+    # Text-to-speech cache and audio size counters
+    cache_stats = tts_cache.stats()
+    tts_audio_stats = audio_stats.stats()
+    for name, value in [
+        ("tts_cache_hits_total", cache_stats["hits"]),
+        ("tts_cache_misses_total", cache_stats["misses"]),
+        ("tts_cache_evictions_total", cache_stats["evictions"]),
+        ("tts_audio_utterances_total", tts_audio_stats["utterances"]),
+        ("tts_audio_bytes_total", tts_audio_stats["bytes"]),
+    ]:
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_labels()} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+def _record_request(response):
+    started = g.pop("request_started", None)
+    if started is not None and request.endpoint != "metrics.metrics":
+        # Use the URL rule, not the path, so /start_conversation/<persona_name> is one series
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        request_metrics.observe(route, request.method, response.status_code, time.perf_counter() - started)
+    return response
+
+
+def init_metrics(app, sample_system=True):
+    """Start the sampler thread (unless sample_system is False) and hook request timing into the app."""
+    if sample_system:
+        system_sampler.start()
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    app.register_blueprint(metrics_bp)
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        abort(401)
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
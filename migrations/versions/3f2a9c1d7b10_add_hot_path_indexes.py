@@ -0,0 +1,43 @@
+"""add hot-path indexes
+
+Revision ID: 3f2a9c1d7b10
+Revises:
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# Tables are created by db.create_all() at startup, which also creates these indexes
+# on a fresh database, so every statement is IF NOT EXISTS / IF EXISTS.
+INDEXES = [
+    ('ix_conversation_user_id_id', 'conversation', 'user_id, id'),
+    ('ix_message_conversation_id_id', 'message', 'conversation_id, id'),
+    ('ix_feedback_conversation_id', 'feedback', 'conversation_id'),
+    ('ix_message_feedback_conversation_id_language', 'message_feedback', 'conversation_id, language'),
+    ('ix_products_name', 'products', 'name'),
+    ('ix_persona_user_id_name', 'persona', 'user_id, name'),
+    ('ix_persona_lower_name', 'persona', 'lower(name)'),
+    ('ix_job_status_run_at', 'job', 'status, run_at'),
+    ('ix_refer_messages_conversation_id', 'refer_messages', 'conversation_id'),
+    ('ix_reflect_feedback_timestamp', 'reflect_feedback', 'timestamp'),
+    ('ix_reflect_feedback_conversation_id', 'reflect_feedback', 'conversation_id'),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+    op.execute('ANALYZE')  # Give the query planner statistics for the new indexes
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        op.execute(f'DROP INDEX IF EXISTS {name}')
@@ -0,0 +1,30 @@
+"""unique message feedback per message and language
+
+Revision ID: 8c41e7b2d5a3
+Revises: 3f2a9c1d7b10
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c41e7b2d5a3'
+down_revision = '3f2a9c1d7b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Concurrent background refreshes could store a turn twice; keep the newest row
+    op.execute(
+        'DELETE FROM message_feedback WHERE id NOT IN '
+        '(SELECT MAX(id) FROM message_feedback GROUP BY message_id, language)'
+    )
+    op.execute('CREATE UNIQUE INDEX IF NOT EXISTS uq_message_feedback_message_id_language '
+               'ON message_feedback (message_id, language)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS uq_message_feedback_message_id_language')
@@ -36,6 +36,9 @@ class User(UserMixin, db.Model):
         return self.id
 
 class Conversation(db.Model):
+    __table_args__ = (
+        db.Index('ix_conversation_user_id_id', 'user_id', 'id'),  # A user's history, newest first
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     persona = db.Column(db.String(100), nullable=False)
@@ -50,6 +53,9 @@ class Conversation(db.Model):
 
 
 class Message(db.Model):
+    __table_args__ = (
+        db.Index('ix_message_conversation_id_id', 'conversation_id', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
     sender = db.Column(db.String(50))
@@ -58,6 +64,9 @@ class Message(db.Model):
 
 
 class Feedback(db.Model):
+    __table_args__ = (
+        db.Index('ix_feedback_conversation_id', 'conversation_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
@@ -65,8 +74,36 @@ class Feedback(db.Model):
 
     conversation = db.relationship('Conversation', backref=db.backref('feedback', lazy=True))
 
+class MessageFeedback(db.Model):
+    """Per-turn feedback computed in the background as agent messages arrive."""
+    __tablename__ = 'message_feedback'
+    __table_args__ = (
+        db.Index('ix_message_feedback_conversation_id_language', 'conversation_id', 'language'),
+        db.Index('uq_message_feedback_message_id_language', 'message_id', 'language', unique=True),  # Upsert target
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
+    language = db.Column(db.String(20), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class FeedbackDraft(db.Model):
+    """Running overall feedback, updated with each new stretch of the rehearsal."""
+    __tablename__ = 'feedback_draft'
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False, unique=True)
+    language = db.Column(db.String(20), nullable=False)
+    overall = db.Column(db.Text, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False, default=0)  # Messages covered by `overall`
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        db.Index('ix_products_name', 'name'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -77,6 +114,9 @@ class Product(db.Model):
 
 
 class Persona(db.Model):
+    __table_args__ = (
+        db.Index('ix_persona_user_id_name', 'user_id', 'name'),  # Predefined (user_id NULL) and per-user lists
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     age = db.Column(db.Integer, nullable=False)
@@ -91,6 +131,34 @@ class Persona(db.Model):
     user = db.relationship('User', backref='personas', lazy=True)
 
 
+# Persona lookups compare lower(name), which a plain index on name cannot serve
+db.Index('ix_persona_lower_name', db.func.lower(Persona.name))
+
+
+
+class Job(db.Model):
+    """A unit of background work run by worker.py (see job_queue.py)."""
+    __tablename__ = 'job'
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),  # Worker polling
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    key = db.Column(db.String(200), unique=True, nullable=True)  # Idempotency key
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    progress = db.Column(db.Float, nullable=False, default=0)
+    progress_message = db.Column(db.String(200))
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    worker = db.Column(db.String(100))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
 
 #-----------------------------------------------------------------------
 #for reflect
@@ -107,14 +175,37 @@ class ReferConversation(db.Model):
 
 class ReferMessage(db.Model):
     __tablename__ = 'refer_messages'  # Explicit table name
+    __table_args__ = (
+        db.Index('ix_refer_messages_conversation_id', 'conversation_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey('refer_conversations.id'), nullable=False)
     sender = db.Column(db.String(50))  # 'user' or 'system' (AI)
     content = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, default=db.func.current_timestamp())
 
+class ReferQuizState(db.Model):
+    """Progress through a Reflect quiz; question text is resolved from question_bank."""
+    __tablename__ = 'refer_quiz_state'
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('refer_conversations.id'), nullable=False, unique=True)
+    language = db.Column(db.String(20), nullable=False)
+    question_ids = db.Column(db.String(500), nullable=False)  # Comma-separated Product ids, in quiz order
+    cursor = db.Column(db.Integer, nullable=False, default=1)  # 1-based number of the question being asked
+    total_questions = db.Column(db.Integer, nullable=False)
+    correct_answers = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def product_ids(self):
+        return [int(product_id) for product_id in self.question_ids.split(',') if product_id]
+
 class ReferFeedback(db.Model):
     __tablename__ = 'reflect_feedback'  # Explicit table name
+    __table_args__ = (
+        db.Index('ix_reflect_feedback_timestamp', 'timestamp'),  # Analytics date-range reports
+        db.Index('ix_reflect_feedback_conversation_id', 'conversation_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey('refer_conversations.id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
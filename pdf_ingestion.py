@@ -0,0 +1,253 @@
+# pdf_ingestion.py
+# Page-level PDF text extraction for Recall. Each page is classified from its
+# text layer and only gets the extra work it needs: camelot for pages that look
+# tabular, OCR for pages without extractable text. Pages run in a process pool
+# and are merged back in page order.
+import os
+import re
+import time
+import threading
+import multiprocessing
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from PyPDF2 import PdfReader
+import camelot
+from pytesseract import image_to_string
+import pdf2image
+
+PDF_INGESTION_WORKERS = int(os.getenv("PDF_INGESTION_WORKERS", min(4, os.cpu_count() or 1)))  # 1 runs pages inline
+# "forkserver" forks pool processes from a server that has only this module loaded
+PDF_INGESTION_START_METHOD = os.getenv("PDF_INGESTION_START_METHOD", "forkserver")
+PDF_MIN_TEXT_CHARS = int(os.getenv("PDF_MIN_TEXT_CHARS", 25))  # Less extractable text than this: the page is OCRed
+PDF_TABLE_MIN_ROWS = int(os.getenv("PDF_TABLE_MIN_ROWS", 3))  # Row-like lines needed before camelot runs on a page
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", 200))  # Render resolution for OCR; memory per page grows with its square
+PDF_OCR_BATCH_PAGES = int(os.getenv("PDF_OCR_BATCH_PAGES", 1))  # Pages rasterized per pdftoppm call
+
+NUMERIC_CELL = re.compile(r"(?:₹|Rs\.?|\$)?\d[\d,]*(?:\.\d+)?%?")
+COLUMN_GAP = re.compile(r"\S(?: {2,}|\t)\S")
+STAGES = ("text", "tables", "ocr")
+
+_readers = {}  # Per-process PdfReader cache, so a pool process parses each document once
+_pool = None  # Kept for the life of the worker process, shared by ingestion jobs
+_pool_lock = threading.Lock()
+
+
+@dataclass
+class PageResult:
+    page_number: int
+    text: str = ""
+    tables: list = field(default_factory=list)
+    ocr_text: str = ""
+    has_text: bool = False
+    has_tables: bool = False
+    image_only: bool = False
+    timings: dict = field(default_factory=dict)  # Stage -> seconds
+
+
+def ingestion_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            context = multiprocessing.get_context(PDF_INGESTION_START_METHOD)
+            if PDF_INGESTION_START_METHOD == "forkserver":
+                context.set_forkserver_preload([__name__])
+            _pool = ProcessPoolExecutor(max_workers=PDF_INGESTION_WORKERS, mp_context=context)
+        return _pool
+
+
+def _discard_pool(pool):
+    # A pool process died (e.g. out of memory during OCR); the next job starts a fresh pool
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _reader(path):
+    reader = _readers.get(path)
+    if reader is None:
+        if len(_readers) >= 4:
+            _readers.clear()
+        reader = _readers[path] = PdfReader(path)
+    return reader
+
+
+def looks_tabular(text):
+    """Whether a page's text layer has enough row-like lines to be worth running camelot on."""
+    rows = 0
+    for line in text.splitlines():
+        if len(NUMERIC_CELL.findall(line)) >= 2 or len(COLUMN_GAP.findall(line)) >= 2:
+            rows += 1
+            if rows >= PDF_TABLE_MIN_ROWS:
+                return True
+    return False
+
+
+def extract_page_tables(path, page_number):
+    try:
+        tables = camelot.read_pdf(path, pages=str(page_number), flavor='stream', strip_text='\n')
+        return [table.df.to_string(index=False) for table in tables]
+    except Exception as e:
+        print(f"Error extracting tables from page {page_number}: {e}")
+        return []
+
+
+def render_pages(path, first_page, last_page):
+    """Yield (page_number, grayscale image) for a page range, PDF_OCR_BATCH_PAGES pages at a time.
+
+    Only one batch of images exists at once: each image is closed as soon as
+    the consumer asks for the next one, so memory does not grow with page count.
+    """
+    batch = max(1, PDF_OCR_BATCH_PAGES)
+    for window_start in range(first_page, last_page + 1, batch):
+        window_end = min(window_start + batch - 1, last_page)
+        images = pdf2image.convert_from_path(
+            path, dpi=PDF_OCR_DPI, first_page=window_start, last_page=window_end, grayscale=True
+        )
+        try:
+            for offset, img in enumerate(images):
+                yield window_start + offset, img
+                img.close()
+        finally:
+            for img in images:
+                img.close()
+            del images
+
+
+def ocr_page(path, page_number):
+    return "\n".join(image_to_string(img) for _, img in render_pages(path, page_number, page_number))
+
+
+def extract_text_from_images(pdf_path, page_count=None):
+    """OCR a whole document, rendering it a window of pages at a time."""
+    if page_count is None:
+        page_count = pdf2image.pdfinfo_from_path(pdf_path)["Pages"]
+    ocr_text = []
+    for page_number, img in render_pages(pdf_path, 1, page_count):
+        print(f"Processing image {page_number}...")
+        ocr_text.append(image_to_string(img))
+    return "\n".join(ocr_text)
+
+
+def process_page(path, page_number):
+    """Extract one page (1-based): text layer, then tables or OCR depending on its classification."""
+    result = PageResult(page_number=page_number)
+
+    started = time.perf_counter()
+    try:
+        result.text = _reader(path).pages[page_number - 1].extract_text() or ""
+    except Exception as e:
+        print(f"Error extracting text from page {page_number}: {e}")
+    result.has_text = len(result.text.strip()) >= PDF_MIN_TEXT_CHARS
+    result.has_tables = result.has_text and looks_tabular(result.text)
+    result.image_only = not result.has_text
+    result.timings["text"] = time.perf_counter() - started
+
+    if result.has_tables:
+        started = time.perf_counter()
+        result.tables = extract_page_tables(path, page_number)
+        result.timings["tables"] = time.perf_counter() - started
+
+    if result.image_only:
+        started = time.perf_counter()
+        try:
+            result.ocr_text = ocr_page(path, page_number)
+        except Exception as e:
+            print(f"Error running OCR on page {page_number}: {e}")
+        result.timings["ocr"] = time.perf_counter() - started
+    return result
+
+
+def merge_pages(results):
+    """Join page results in page order, numbering tables through the document."""
+    parts = []
+    table_count = 0
+    for result in sorted(results, key=lambda r: r.page_number):
+        if result.text:
+            parts.append(result.text)
+        for table in result.tables:
+            table_count += 1
+            parts.append(f"--- Table {table_count} ---\n{table}")
+        if result.ocr_text:
+            parts.append(result.ocr_text)
+    return "\n".join(parts)
+
+
+def summarize(path, results):
+    """Page counts by class and total seconds per stage (summed over pages), for the ingestion log."""
+    timings = {stage: round(sum(r.timings.get(stage, 0) for r in results), 2) for stage in STAGES}
+    return {
+        "document": os.path.basename(path),
+        "pages": len(results),
+        "text_pages": sum(1 for r in results if r.has_text),
+        "table_pages": sum(1 for r in results if r.has_tables),
+        "image_pages": sum(1 for r in results if r.image_only),
+        "tables": sum(len(r.tables) for r in results),
+        "timings": timings,
+    }
+
+
+def extract_documents(paths, on_page=None):
+    """Extract text from PDF files, fanning their pages out to a process pool.
+
+    Returns [(path, text, stats)] in input order. A document PyPDF2 cannot
+    open is OCRed as a whole instead (empty text if that fails too).
+    on_page(done, total) is called as pages finish.
+    """
+    paths = list(dict.fromkeys(paths))  # The same file uploaded twice is extracted once
+    page_counts = {}
+    unreadable = []
+    for path in paths:
+        try:
+            page_counts[path] = len(PdfReader(path).pages)
+        except Exception as e:
+            print(f"Error reading PDF file: {e}")
+            page_counts[path] = 0
+            unreadable.append(path)
+    total = sum(page_counts.values())
+    results = {path: [] for path in paths}
+    started = time.perf_counter()
+    done = 0
+
+    def collect(path, result):
+        nonlocal done
+        results[path].append(result)
+        done += 1
+        if on_page:
+            on_page(done, total)
+
+    if PDF_INGESTION_WORKERS <= 1 or total <= 1:
+        for path in paths:
+            for page_number in range(1, page_counts[path] + 1):
+                collect(path, process_page(path, page_number))
+    else:
+        pool = ingestion_pool()
+        try:
+            futures = {
+                pool.submit(process_page, path, page_number): path
+                for path in paths
+                for page_number in range(1, page_counts[path] + 1)
+            }
+            for future in as_completed(futures):
+                collect(futures[future], future.result())
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            raise
+
+    documents = []
+    for path in paths:
+        stats = summarize(path, results[path])
+        text = merge_pages(results[path])
+        if path in unreadable:
+            ocr_started = time.perf_counter()
+            try:
+                text = extract_text_from_images(path)
+            except Exception as e:
+                print(f"Error running OCR on {path}: {e}")
+            stats["timings"]["ocr"] = round(time.perf_counter() - ocr_started, 2)
+        print(f"Extracted {path}: {stats}")
+        documents.append((path, text, stats))
+    print(f"Extracted {total} pages from {len(paths)} documents in {time.perf_counter() - started:.2f}s")
+    return documents
@@ -0,0 +1,100 @@
+# question_bank.py
+# In-memory copy of the Reflect product questions, so quiz turns never read the
+# products table. Admin writes bump a version file, and every worker reloads its
+# copy the next time it sees a new version.
+import os
+import time
+import threading
+from models import Product
+
+QUESTION_BANK_VERSION_FILE = os.getenv("QUESTION_BANK_VERSION_FILE", os.path.join("instance", "question_bank.version"))
+LANGUAGES = ("English", "Hindi")
+
+
+class QuestionBank:
+    """Product questions indexed by id, by (product, language) and by question text.
+
+    The loaded snapshot is tagged with the contents of the version file; a
+    lookup that finds a different version on disk reloads first.
+    """
+
+    def __init__(self, version_file):
+        self.version_file = version_file
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._version = None
+
+    def _read_version(self):
+        try:
+            with open(self.version_file) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return ""
+
+    def _load(self):
+        questions = {}  # Product.id -> {"name", "English": (question, answer), "Hindi": (question, answer)}
+        by_product_language = {}  # (name, language) -> [(id, question, answer)]
+        answers_by_text = {}  # (name, language, question) -> answer
+        for product in Product.query.order_by(Product.id).all():
+            entry = {
+                "name": product.name,
+                "English": (product.question_english, product.answer_english),
+                "Hindi": (product.question_hindi, product.answer_hindi),
+            }
+            questions[product.id] = entry
+            for language in LANGUAGES:
+                question, answer = entry[language]
+                by_product_language.setdefault((product.name, language), []).append((product.id, question, answer))
+                answers_by_text.setdefault((product.name, language, question), answer)
+        return {
+            "questions": questions,
+            "by_product_language": by_product_language,
+            "answers_by_text": answers_by_text,
+            "product_names": sorted({entry["name"] for entry in questions.values()}),
+        }
+
+    def _current(self):
+        version = self._read_version()
+        snapshot = self._snapshot
+        if snapshot is not None and version == self._version:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or version != self._version:
+                self._snapshot = self._load()
+                self._version = version
+            return self._snapshot
+
+    def invalidate(self):
+        """Call after changing the products table: every worker reloads on its next lookup."""
+        directory = os.path.dirname(self.version_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.version_file}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(str(time.time_ns()))
+        os.replace(temp_path, self.version_file)
+
+    def product_names(self):
+        return list(self._current()["product_names"])
+
+    def question_ids(self, product_name):
+        return [product_id for product_id, _, _ in self._current()["by_product_language"].get((product_name, "English"), [])]
+
+    def questions(self, product_name, language):
+        """[(id, question, answer)] for a product in the given language."""
+        language = "Hindi" if language == "Hindi" else "English"
+        return list(self._current()["by_product_language"].get((product_name, language), []))
+
+    def question(self, product_id, language):
+        """(question, answer) in the given language, or None if the row is gone."""
+        entry = self._current()["questions"].get(product_id)
+        if entry is None:
+            return None
+        return entry["Hindi"] if language == "Hindi" else entry["English"]
+
+    def answer_for_text(self, product_name, question, language):
+        language = "Hindi" if language == "Hindi" else "English"
+        return self._current()["answers_by_text"].get((product_name, language, question))
+
+
+question_bank = QuestionBank(QUESTION_BANK_VERSION_FILE)
@@ -4,7 +4,9 @@ import random, uuid
 from datetime import datetime
 import azure.cognitiveservices.speech as speechsdk
 import asyncio
-from models import Product, ReferConversation, Conversation, ReferFeedback, ReferMessage  # Adjust based on your project structure
+import click
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from models import Product, ReferConversation, Conversation, ReferFeedback, ReferMessage, ReferQuizState  # Adjust based on your project structure
 from flask import Blueprint
 import os
 import google.generativeai as genai
@@ -13,6 +15,11 @@ from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_google_genai import ChatGoogleGenerativeAI
 from flask import current_app
 from extensions import login_manager, csrf, mail, oauth, db
+from tts_service import speech_url, prefetched_speech_url, speech_prefetcher, synthesize_to_file, tts_cache, TTS_CACHE_ENABLED, VOICE_MAPPING, ENGLISH_VOICE
+from message_store import store_message, unit_of_work, flush_messages, save
+from question_bank import question_bank
+from transcript_correction import correct_transcript, TRANSCRIPT_CORRECTION_MODE
+from answer_grader import pre_grade, template_feedback, log_agreement, maybe_audit, ANSWER_GRADER_MODE
 
 # Blueprints
 reflect_bp = Blueprint('reflect', __name__)
@@ -27,12 +34,6 @@ azure_region = os.getenv("AZURE_REGION")
 genai.configure(api_key=api_key)
 llm = ChatGoogleGenerativeAI(model="gemini-pro", convert_system_message_to_human=True, temperature=0.8)
 
-# Voice mappings for personas
-VOICE_MAPPING = {
-    "Male": "hi-IN-MadhurNeural",
-    "Female": "hi-IN-SwaraNeural"
-}
-
 # Route to add refer message to conversation
 @reflect_bp.route('/add_refer_message', methods=['POST'])
 @login_required
@@ -56,10 +57,8 @@ def add_refer_message():
 @login_required
 def reset_session():
     # Clear session data related to the conversation
+    # Quiz progress lives in ReferQuizState; the session only points at the conversation
     session.pop('conversation_id', None)
-    session.pop('shuffled_questions', None)
-    session.pop('questions_asked', None)
-    session.pop('correct_answers', None)
     session.modified = True
     return jsonify({"status": "Session reset successfully"})
 
@@ -70,8 +69,7 @@ def reset_session():
 @login_required
 def load_products():
     try:
-        products = db.session.query(Product.name).distinct().all()
-        product_list = [{"name": product[0]} for product in products]
+        product_list = [{"name": name} for name in question_bank.product_names()]
         return jsonify({"products": product_list})
     except Exception as e:
         current_app.logger.error(f"Error loading products: {e}")
@@ -79,14 +77,9 @@ def load_products():
 
 # Function to get questions and answers for the selected product
 def get_product_questions(product_name, language):
-    if language == "Hindi":
-        products = Product.query.filter_by(name=product_name).with_entities(Product.question_hindi, Product.answer_hindi).all()
-    else:
-        products = Product.query.filter_by(name=product_name).with_entities(Product.question_english, Product.answer_english).all()
-
     product_questions = []
     product_answers = []
-    for question, answer in products:
+    for _, question, answer in question_bank.questions(product_name, language):
         product_questions.append(question)
         product_answers.append(answer)
 
@@ -96,15 +89,7 @@ def get_product_questions(product_name, language):
 
 # Function to get the correct answer for a given question
 def get_correct_answer(product_name, current_question, language):
-    if language == "Hindi":
-        correct_answer_row = Product.query.filter_by(name=product_name, question_hindi=current_question).first()
-        if correct_answer_row:
-            return correct_answer_row.answer_hindi
-    else:
-        correct_answer_row = Product.query.filter_by(name=product_name, question_english=current_question).first()
-        if correct_answer_row:
-            return correct_answer_row.answer_english
-    return None
+    return question_bank.answer_for_text(product_name, current_question, language)
 
 # Main conversation handler
 # Main conversation handler
@@ -130,82 +115,56 @@ async def manage_conversation(product_name):
             # Initialize a new conversation
             conversation_id = initialize_refer_conversation(current_user.id, product_name)
             session['conversation_id'] = conversation_id
-            session['score'] = 0
-            session['questions_asked'] = 0
-            session['correct_answers'] = 0
-
-            # If there's user input at the start, save it as the first message
-            if user_answer:
-                add_refer_message(conversation_id, sender='user', content=user_answer)
-
-            # Fetch both questions and their corresponding answers based on language
-            if language == "Hindi":
-                product_questions = Product.query.filter_by(name=product_name).with_entities(
-                    Product.question_hindi, Product.answer_hindi).all()
-            else:
-                product_questions = Product.query.filter_by(name=product_name).with_entities(
-                    Product.question_english, Product.answer_english).all()
 
-            if not product_questions:
-                return jsonify({"error": "No questions found for the selected product."}), 404
+            # Question ids for the product; the text comes from the in-memory question bank
+            question_ids = question_bank.question_ids(product_name)
 
-            # Shuffle the questions while keeping answers paired
-            random.shuffle(product_questions)
+            if not question_ids:
+                return jsonify({"error": "No questions found for the selected product."}), 404
 
-            # Store both questions and answers in session for easy retrieval
-            session['shuffled_questions'] = [{'question': q[0], 'answer': q[1]} for q in product_questions]
-            session['total_questions'] = min(10, len(session['shuffled_questions']))  # Set total to 10
+            # Shuffle the questions and keep the first 10 for this quiz
+            random.shuffle(question_ids)
+            question_ids = question_ids[:10]
+            quiz = ReferQuizState(
+                conversation_id=conversation_id,
+                language=language,
+                question_ids=",".join(str(question_id) for question_id in question_ids),
+                cursor=1,
+                total_questions=len(question_ids),
+                correct_answers=0
+            )
 
             # Get the first question
-            current_question = session['shuffled_questions'][0]['question']
-            session['current_question'] = current_question
-            session['questions_asked'] = 1
-            session.modified = True
+            current_question = question_bank.question(question_ids[0], language)[0]
 
             # AI Coach greeting and context setting based on selected language
-            if session['language'] == "Hindi":
-                """
-                hindi_greetings = [
-                    f"नमस्ते! मैं आज आपका कोच हूँ। हम साथ में {product_name} के बारे में आपके ज्ञान को समझेंगे। कोई चिंता की बात नहीं, मैं यहाँ आपकी मदद के लिए हूँ। यह रहा आपका पहला प्रश्न।",
-                    f"नमस्कार! आज हम {product_name} के बारे में आपकी समझ का परीक्षण करेंगे। मैं आपके साथ हूँ और हर कदम पर आपका मार्गदर्शन करूंगा। तो, शुरू करते हैं। यहाँ पहला प्रश्न है।",
-                    f"आपका स्वागत है! मैं आपका कोच हूँ और आज हम {product_name} से जुड़ी कुछ बातें जानेंगे। आप तैयार हैं? तो चलिए शुरू करते हैं, यह रहा पहला सवाल।",
-                    f"नमस्ते! मैं यहाँ हूँ आपकी मदद के लिए, ताकि हम मिलकर {product_name} के बारे में आपकी जानकारी को सुधारें। कोई भी संकोच मत कीजिए, यह रहा आपका पहला प्रश्न।",
-                    f"नमस्कार! आज हम {product_name} पर आधारित आपके ज्ञान का मूल्यांकन करेंगे। चिंता मत कीजिए, मैं आपके साथ हूँ। शुरू करते हैं, यह रहा पहला सवाल।"
-                ]
-                """
-                hindi_greetings = [
-                    f"नमस्ते! "
-                ]
-                # Randomly select a greeting
-                coach_greeting = random.choice(hindi_greetings)
-                question_prompt = current_question
-            else:
-                english_greetings = [
-                    f"Hello! I'm your coach today. Let’s explore your knowledge of {product_name}. Don’t worry, I’m here to guide you. Here’s your first question.",
-                    f"Welcome! I'm here to help you test your understanding of {product_name}. Ready? Let’s dive in. Here's the first question for you.",
-                    f"Hello! Let’s work together to assess your knowledge of {product_name}. No need to worry, I’ll be right here to assist. Here's your first question.",
-                    f"Greetings! I'm your coach today, and we’ll be covering {product_name}. Don’t worry, I’ll guide you through it step by step. Let's begin with the first question.",
-                    f"Hi! I’m here to guide you through a quick test of your knowledge on {product_name}. I’ll be with you throughout. Here’s your first question."
-                ]
-                # Randomly select a greeting
-                coach_greeting = random.choice(english_greetings)
-                question_prompt = current_question
+            coach_greeting = random.choice(coach_greetings(product_name, language))
+            question_prompt = current_question
 
             # Synthesize and return the first question with audio
             conversation_context = f"{coach_greeting}\n{question_prompt}"
-            add_refer_message(conversation_id, sender='Question', content=question_prompt)
+            with unit_of_work():
+                save(quiz)
+                # If there's user input at the start, save it as the first message
+                if user_answer:
+                    add_refer_message(conversation_id, sender='user', content=user_answer)
+                add_refer_message(conversation_id, sender='Question', content=question_prompt)
 
             current_app.logger.info(f"Generating speech for: {conversation_context}")
-            audio_file_name = await synthesize_speech(conversation_context, language)
-            current_app.logger.info(f"Audio file generated: {audio_file_name}")
+            # Nothing prefetched this utterance, so there is nothing to wait for: in
+            # "stream" delivery the URL comes back at once and synthesis starts
+            # when the browser fetches it
+            audio_url = await asyncio.to_thread(speech_url, conversation_context, speech_voice(language), language)
+            current_app.logger.info(f"Audio URL generated: {audio_url}")
 
-            if not audio_file_name:
+            if not audio_url:
                 current_app.logger.error(f"Error generating audio for question prompt: {conversation_context}")
                 return jsonify({"error": "Failed to generate audio for the conversation."}), 500
 
+            prefetch_next_question(quiz)
             return jsonify({
                 "text": current_question,
-                "audio": f"/static/{audio_file_name}",
+                "audio": audio_url,
                 "conversation_id": conversation_id
             })
 
@@ -213,77 +172,61 @@ async def manage_conversation(product_name):
         if action == 'answer':
 
             # Provide feedback for the current answer
-            if 'shuffled_questions' not in session or 'questions_asked' not in session:
-                current_app.logger.error("Session data missing: shuffled_questions or questions_asked")
+            quiz = load_quiz_state(conversation_id)
+            if not quiz:
+                current_app.logger.error(f"Quiz state missing for conversation {conversation_id}")
                 return jsonify({"error": "Session data is missing."}), 400
 
-            current_question_index = session['questions_asked'] - 1
+            current_question_index = quiz.cursor - 1
+            product_ids = quiz.product_ids
 
             # Ensure the index is within bounds
-            if current_question_index >= len(session['shuffled_questions']):
+            if current_question_index >= len(product_ids):
                 return jsonify({"error": "No more questions available."}), 400
 
-            current_qa_pair = session['shuffled_questions'][current_question_index]
-            correct_answer = current_qa_pair['answer']
+            current_qa_pair = question_bank.question(product_ids[current_question_index], quiz.language)
+            if not current_qa_pair:
+                return jsonify({"error": "This question is no longer available."}), 400
+            correct_answer = current_qa_pair[1]
 
             current_app.logger.info(
                 f"Current question index: {current_question_index}, Correct Answer: {correct_answer}")
 
-            prompt = [
-                SystemMessage(
-                    content=f"""
-                        You are tasked with correcting **only** the misspelled words, grammatical errors, or mispronounced words in the user's answer. 
-
-                        **Important Instructions**:
-                        - **Do not change the meaning** or rephrase the sentence.
-                        - **Do not replace the user's original answer with the correct answer**; just correct specific mistakes.
-                        - **Focus on key terms that might be misheard or mispronounced** (e.g., technical terms like "Single Pay", "Limited Pay", "Regular Pay", "Deferment", "Assured Wealth Goal plan", "surrender value", "premiums", "Life Stage", "Sum Assured", "terminal", "lump sum", "Life Shield", "Death Benefit", "Pay" or "Regular" that might be critical to understanding the context).
-                        - Preserve the overall phrasing and structure of the user's original answer as much as possible.
-
-                        Here is the user's answer: "{user_answer}"
-
-                        Compare it with the context of the correct answer: "{correct_answer}"
-
-                        Your job is to:
-                        - Correct only spelling, grammar, and pronunciation errors.
-                        - Ensure important key terms, like product names or financial terms, are correctly spelled (e.g., "Single Pay" should not be changed to "Single Phase").
-
-                        Do not rephrase or restructure the user's original response, but ensure the corrections maintain clarity and accuracy.
-                    """
-                ),
-                HumanMessage(content=user_answer)
-            ]
-
-            # AI LLM call to generate a human-like conversational response
-            response = await asyncio.to_thread(llm.invoke, prompt)
-            user_answer1 = response.content
-            user_answer2 = user_answer1.replace('*', '')
+            # Fix mis-heard key terms locally; only transcripts with near misses go to the LLM
+            correction = correct_transcript(user_answer, product_name) if TRANSCRIPT_CORRECTION_MODE == "local" else None
+            if correction and correction.confident:
+                user_answer2 = correction.text
+                current_app.logger.info(f"Transcript corrected locally: {correction.corrections}")
+            else:
+                if correction:
+                    current_app.logger.info(f"Transcript near misses, asking the LLM: {correction.near_misses}")
+                user_answer2 = await llm_correct_transcript(user_answer, correct_answer)
             current_app.logger.info(f"user_answer 02: {user_answer2}")
             current_app.logger.info(f"language: {language}")
-            # Log the user's response
-            add_refer_message(conversation_id, sender='user', content=user_answer2)
             # Generate feedback for the current question
-            feedback_text = await get_coach_feedback(user_answer2, correct_answer, language)
-            add_refer_message(conversation_id, sender='AI', content=feedback_text)
+            feedback_text = await grade_answer(user_answer2, correct_answer, language, product_name)
+            # Save the user's response, the feedback and the updated score together
+            with unit_of_work():
+                add_refer_message(conversation_id, sender='user', content=user_answer2)
+                add_refer_message(conversation_id, sender='AI', content=feedback_text)
+
+                # Update the quiz score based on the feedback
+                if "आपका उत्तर सही है" in feedback_text.lower() or "your answer is correct" in feedback_text.lower():
+                    quiz.correct_answers += 1
+                elif "आपका उत्तर आंशिक रूप से सही है" in feedback_text.lower() or "your answer is partially correct" in feedback_text.lower():
+                    quiz.correct_answers += 0.5
 
-            # Update session score based on the feedback
-            if "आपका उत्तर सही है" in feedback_text.lower() or "your answer is correct" in feedback_text.lower():
-                session['correct_answers'] += 1
-            elif "आपका उत्तर आंशिक रूप से सही है" in feedback_text.lower() or "your answer is partially correct" in feedback_text.lower():
-                session['correct_answers'] += 0.5
-
-            session.modified = True  # Ensure session update is persisted
             current_app.logger.info(f"Coach feedback: {feedback_text}")
-            current_app.logger.info(f"Coach Score: {session['correct_answers']}")
+            current_app.logger.info(f"Coach Score: {quiz.correct_answers}")
 
-            feedback_audio_file_name = await synthesize_speech(feedback_text, language)
-            if not feedback_audio_file_name:
+            feedback_audio_url = await synthesize_speech(feedback_text, language)
+            if not feedback_audio_url:
                 current_app.logger.error(f"Error generating audio for feedback: {feedback_text}")
                 return jsonify({"error": "Failed to generate audio for feedback."}), 500
 
             return jsonify({
                 "feedback_text": feedback_text,
-                "feedback_audio": f"/static/{feedback_audio_file_name}",
+                "feedback_audio": feedback_audio_url,
                 "correct_answer": correct_answer,
                 "user_answer2": user_answer2,
                 "conversation_id": conversation_id,
@@ -292,19 +235,23 @@ async def manage_conversation(product_name):
 
         elif action == 'next_question':
             # Provide the next question if available
+            quiz = load_quiz_state(conversation_id)
+            if not quiz:
+                current_app.logger.error(f"Quiz state missing for conversation {conversation_id}")
+                return jsonify({"error": "Session data is missing."}), 400
 
-            session['questions_asked'] += 1
-            session.modified = True  # Ensure session update is persisted
+            quiz.cursor += 1  # Committed below with the final feedback or the next question
 
             # Enforce the limit of 10 questions
-            if session['questions_asked'] > session['total_questions']:
+            if quiz.cursor > quiz.total_questions:
                 # No more questions available, return final feedback
-                final_score = session['correct_answers']
-                final_feedback = generate_feedback(final_score, session['total_questions'])
-                final_feedback_audio_file_name = await synthesize_speech(final_feedback, language)
+                final_score = quiz.correct_answers
+                final_feedback = generate_feedback(final_score, quiz.total_questions)
+                final_feedback_audio_url = await synthesize_speech(final_feedback, language)
 
                 # Add this code here to save the final feedback to the database
                 final_feedback_text = final_feedback
+                flush_messages()  # The quiz is over: make sure its buffered messages are written
                 try:
                     feedback_entry = ReferFeedback(
                         conversation_id=conversation_id,
@@ -322,25 +269,31 @@ async def manage_conversation(product_name):
 
                 return jsonify({
                     "final_feedback_text": final_feedback,
-                    "final_feedback_audio": f"/static/{final_feedback_audio_file_name}",
+                    "final_feedback_audio": final_feedback_audio_url,
                     "conversation_id": conversation_id,
                     "is_final_feedback": True
                 })
 
             # If more questions are available, serve the next question
-            next_question_index = session['questions_asked'] - 1
+            next_question_index = quiz.cursor - 1
+            product_ids = quiz.product_ids
             # Ensure the next question index is valid
-            if next_question_index >= len(session['shuffled_questions']):
+            if next_question_index >= len(product_ids):
                 return jsonify({"error": "No more questions available."}), 400
 
             # Get the next question
-            next_question = session['shuffled_questions'][next_question_index]['question']
-            add_refer_message(conversation_id, sender='Question', content=next_question)
-            next_question_audio_file_name = await synthesize_speech(next_question, language)
+            next_qa_pair = question_bank.question(product_ids[next_question_index], quiz.language)
+            if not next_qa_pair:
+                return jsonify({"error": "This question is no longer available."}), 400
+            next_question = next_qa_pair[0]
+            with unit_of_work():
+                add_refer_message(conversation_id, sender='Question', content=next_question)
+            next_question_audio_url = await synthesize_speech(next_question, language)
+            prefetch_next_question(quiz)
 
             return jsonify({
                 "next_question_text": next_question,
-                "next_question_audio": f"/static/{next_question_audio_file_name}",
+                "next_question_audio": next_question_audio_url,
                 "conversation_id": conversation_id,
                 "is_final_feedback": False
             })
@@ -355,6 +308,52 @@ async def manage_conversation(product_name):
 
 
 # Utility functions for AI feedback and speech synthesis
+async def llm_correct_transcript(user_answer, correct_answer):
+    # Function to fix spelling and mis-heard terms in the user's answer with the LLM
+    prompt = [
+        SystemMessage(
+            content=f"""
+                You are tasked with correcting **only** the misspelled words, grammatical errors, or mispronounced words in the user's answer. 
+
+                **Important Instructions**:
+                - **Do not change the meaning** or rephrase the sentence.
+                - **Do not replace the user's original answer with the correct answer**; just correct specific mistakes.
+                - **Focus on key terms that might be misheard or mispronounced** (e.g., technical terms like "Single Pay", "Limited Pay", "Regular Pay", "Deferment", "Assured Wealth Goal plan", "surrender value", "premiums", "Life Stage", "Sum Assured", "terminal", "lump sum", "Life Shield", "Death Benefit", "Pay" or "Regular" that might be critical to understanding the context).
+                - Preserve the overall phrasing and structure of the user's original answer as much as possible.
+
+                Here is the user's answer: "{user_answer}"
+
+                Compare it with the context of the correct answer: "{correct_answer}"
+
+                Your job is to:
+                - Correct only spelling, grammar, and pronunciation errors.
+                - Ensure important key terms, like product names or financial terms, are correctly spelled (e.g., "Single Pay" should not be changed to "Single Phase").
+
+                Do not rephrase or restructure the user's original response, but ensure the corrections maintain clarity and accuracy.
+            """
+        ),
+        HumanMessage(content=user_answer)
+    ]
+
+    # AI LLM call to generate a human-like conversational response
+    response = await asyncio.to_thread(llm.invoke, prompt)
+    user_answer1 = response.content
+    return user_answer1.replace('*', '')
+
+
+async def grade_answer(user_answer2, correct_answer, language, product_name):
+    """Coach feedback for an answer: from templates when the local pre-grade is clear, else from the LLM."""
+    estimate = pre_grade(user_answer2, correct_answer, product_name)
+    if ANSWER_GRADER_MODE == "local" and estimate.verdict:
+        current_app.logger.info(f"Answer graded locally as {estimate.verdict} (score {estimate.score})")
+        maybe_audit(estimate, lambda: asyncio.run(get_coach_feedback(user_answer2, correct_answer, language)))
+        return template_feedback(estimate.verdict, correct_answer, language)
+
+    feedback_text = await get_coach_feedback(user_answer2, correct_answer, language)
+    log_agreement(estimate, feedback_text, "llm")
+    return feedback_text
+
+
 async def get_coach_feedback(user_answer2, correct_answer, language):
     # Function to generate AI feedback based on the user's answer
     if language == "Hindi":
@@ -422,15 +421,111 @@ async def get_coach_feedback(user_answer2, correct_answer, language):
     return correct_answer_clean
 
 
+def coach_greetings(product_name, language):
+    """Greetings the AI coach can open a quiz with; the first question follows on the next line."""
+    if language == "Hindi":
+        """
+        hindi_greetings = [
+            f"नमस्ते! मैं आज आपका कोच हूँ। हम साथ में {product_name} के बारे में आपके ज्ञान को समझेंगे। कोई चिंता की बात नहीं, मैं यहाँ आपकी मदद के लिए हूँ। यह रहा आपका पहला प्रश्न।",
+            f"नमस्कार! आज हम {product_name} के बारे में आपकी समझ का परीक्षण करेंगे। मैं आपके साथ हूँ और हर कदम पर आपका मार्गदर्शन करूंगा। तो, शुरू करते हैं। यहाँ पहला प्रश्न है।",
+            f"आपका स्वागत है! मैं आपका कोच हूँ और आज हम {product_name} से जुड़ी कुछ बातें जानेंगे। आप तैयार हैं? तो चलिए शुरू करते हैं, यह रहा पहला सवाल।",
+            f"नमस्ते! मैं यहाँ हूँ आपकी मदद के लिए, ताकि हम मिलकर {product_name} के बारे में आपकी जानकारी को सुधारें। कोई भी संकोच मत कीजिए, यह रहा आपका पहला प्रश्न।",
+            f"नमस्कार! आज हम {product_name} पर आधारित आपके ज्ञान का मूल्यांकन करेंगे। चिंता मत कीजिए, मैं आपके साथ हूँ। शुरू करते हैं, यह रहा पहला सवाल।"
+        ]
+        """
+        return [
+            f"नमस्ते! "
+        ]
+    return [
+        f"Hello! I'm your coach today. Let’s explore your knowledge of {product_name}. Don’t worry, I’m here to guide you. Here’s your first question.",
+        f"Welcome! I'm here to help you test your understanding of {product_name}. Ready? Let’s dive in. Here's the first question for you.",
+        f"Hello! Let’s work together to assess your knowledge of {product_name}. No need to worry, I’ll be right here to assist. Here's your first question.",
+        f"Greetings! I'm your coach today, and we’ll be covering {product_name}. Don’t worry, I’ll guide you through it step by step. Let's begin with the first question.",
+        f"Hi! I’m here to guide you through a quick test of your knowledge on {product_name}. I’ll be with you throughout. Here’s your first question."
+    ]
+
+
+def speech_voice(language):
+    return VOICE_MAPPING["Male"] if language == "Hindi" else ENGLISH_VOICE
+
+
 async def synthesize_speech(text, language):
-    selected_voice = VOICE_MAPPING["Male"] if language == "Hindi" else "en-IN-PrabhatNeural"
-    speech_config = speechsdk.SpeechConfig(subscription=azure_subscription_key, region=azure_region)
-    speech_config.speech_synthesis_voice_name = selected_voice
-    audio_file_name = str(uuid.uuid4()) + ".mp3"
-    audio_config = speechsdk.audio.AudioOutputConfig(filename=f"static/{audio_file_name}")
-    speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=audio_config)
-    result = await asyncio.to_thread(speech_synthesizer.speak_text_async(text).get)
-    return audio_file_name if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted else None
+    # Question bank audio repeats constantly, so this is usually a cache lookup,
+    # or a short wait on the prefetch started when the previous question was served.
+    # None means synthesis failed, which is only known here in "file" delivery
+    # mode; a failed stream URL answers 502 and the page's audio player reports it.
+    return await asyncio.to_thread(prefetched_speech_url, text, speech_voice(language), language)
+
+
+def prefetch_speech(text, language):
+    speech_prefetcher.prefetch(text, speech_voice(language), language)
+
+
+def reflect_utterances(language, product_names=None):
+    """Every text the Reflect coach can speak: each question alone and after each greeting."""
+    for product_name in product_names or question_bank.product_names():
+        greetings = coach_greetings(product_name, language)
+        for _, question, _ in question_bank.questions(product_name, language):
+            yield question
+            for greeting in greetings:
+                yield f"{greeting}\n{question}"
+
+
+@reflect_bp.cli.command("warm-tts")
+@click.option("--language", "languages", multiple=True, type=click.Choice(["English", "Hindi"]), help="Only this language (repeatable). Default: both.")
+@click.option("--product", "product_names", multiple=True, help="Only this product (repeatable). Default: all products.")
+@click.option("--concurrency", default=4, show_default=True, help="Utterances synthesized at the same time.")
+def warm_tts_cache(languages, product_names, concurrency):
+    """Synthesize every Reflect question and greeting into the TTS cache.
+
+    Utterances that are already cached are skipped, so an interrupted run is
+    resumed by running the command again. Make sure TTS_CACHE_MAX_BYTES is
+    large enough to hold the whole question bank, or older entries are evicted.
+    Usage: flask --app main reflect warm-tts
+    """
+    if not TTS_CACHE_ENABLED:
+        raise click.ClickException("TTS_CACHE_ENABLED is off, so there is no cache to warm.")
+
+    todo = {}
+    cached = 0
+    for language in languages or ("English", "Hindi"):
+        voice = speech_voice(language)
+        for text in reflect_utterances(language, product_names):
+            key = tts_cache.key(voice, language, text)
+            if key in todo:
+                continue
+            if os.path.exists(tts_cache.path_for(key)):
+                cached += 1
+            else:
+                todo[key] = (text, voice, language)
+    click.echo(f"{len(todo)} utterances to synthesize, {cached} already cached")
+
+    completed = failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(synthesize_to_file, *utterance): utterance for utterance in todo.values()}
+        for future in as_completed(futures):
+            text, _, language = futures[future]
+            try:
+                ok = future.result() is not None
+            except Exception as e:
+                current_app.logger.error(f"Error warming TTS cache for {text!r}: {e}")
+                ok = False
+            completed += ok
+            failed += not ok
+            click.echo(f"[{completed + failed}/{len(todo)}] {'ok' if ok else 'FAILED'} {language}: {text[:60]!r}")
+
+    click.echo(f"Done: {completed} synthesized, {failed} failed, {cached} already cached")
+    if failed:
+        raise click.ClickException(f"{failed} utterances failed; run the command again to retry them.")
+
+
+def prefetch_next_question(quiz):
+    """Start synthesizing the question after the one being served, while the user answers."""
+    product_ids = quiz.product_ids
+    if quiz.cursor < min(len(product_ids), quiz.total_questions):
+        next_qa_pair = question_bank.question(product_ids[quiz.cursor], quiz.language)
+        if next_qa_pair:
+            prefetch_speech(next_qa_pair[0], quiz.language)
 
 
 # Helper function to generate feedback based on the score
@@ -461,10 +556,12 @@ def initialize_refer_conversation(user_id, product_name):
     db.session.commit()
     return conversation.id
 
+def load_quiz_state(conversation_id):
+    return ReferQuizState.query.filter_by(conversation_id=conversation_id).first()
+
 def add_refer_message(conversation_id, sender, content):
-    message = ReferMessage(conversation_id=conversation_id, sender=sender, content=content)
-    db.session.add(message)
-    db.session.commit()
+    # Commits immediately, or as part of the enclosing unit_of_work()
+    return store_message(ReferMessage, conversation_id=conversation_id, sender=sender, content=content)
 
 
 
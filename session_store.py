@@ -0,0 +1,181 @@
+# session_store.py
+# Server-side sessions in a SQLite file shared by every gunicorn worker.
+# Enable with SESSION_BACKEND=sqlite; the default stays Flask-Session's filesystem store.
+import os
+import time
+import zlib
+import hashlib
+import secrets
+import sqlite3
+import logging
+import threading
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "filesystem")  # "filesystem" or "sqlite"
+# Put the file on tmpfs (e.g. /dev/shm/winntek_sessions.sqlite) to keep sessions in shared memory
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", os.path.join("instance", "sessions.sqlite"))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", 5 * 60))  # Seconds between expired-session sweeps
+SESSION_COMPRESS_MIN_BYTES = 1024  # Payloads larger than this are zlib-compressed
+
+# Leading byte of the stored payload
+RAW_PAYLOAD = b"j"
+COMPRESSED_PAYLOAD = b"z"
+
+
+class StoredSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, digest=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.digest = digest  # Hash of the payload as loaded, to skip writes when nothing changed
+        self.expires_at = expires_at
+        self.modified = False
+
+
+class SQLiteSessionStore:
+    """Session rows (id, payload, expiry) in a WAL-mode SQLite file, one connection per thread."""
+
+    def __init__(self, path, sweep_interval):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self._local = threading.local()
+        self._last_sweep = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, payload BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_sessions_expires_at ON sessions (expires_at)")
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=15)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, sid):
+        row = self.connection().execute(
+            "SELECT payload, expires_at FROM sessions WHERE id = ? AND expires_at > ?", (sid, time.time())
+        ).fetchone()
+        return (bytes(row[0]), row[1]) if row else (None, None)
+
+    def save(self, sid, payload, expires_at):
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, payload, expires_at) VALUES (?, ?, ?)",
+                (sid, payload, expires_at)
+            )
+        self.maybe_sweep()
+
+    def touch(self, sid, expires_at):
+        with self.connection() as conn:
+            conn.execute("UPDATE sessions SET expires_at = ? WHERE id = ?", (expires_at, sid))
+
+    def delete(self, sid):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+    def maybe_sweep(self):
+        now = time.time()
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        with self.connection() as conn:
+            removed = conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,)).rowcount
+        if removed:
+            logging.info(f"Removed {removed} expired sessions")
+
+
+class SQLiteSessionInterface(SessionInterface):
+    """Flask session interface backed by SQLiteSessionStore.
+
+    Sessions are serialized with Flask's tagged JSON (compressed when large)
+    and only written when their content actually changed, so routes that set
+    session.modified = True without changing anything cost no write. Unchanged
+    permanent sessions just have their expiry extended, at most once per tenth
+    of the lifetime.
+    """
+
+    serializer = TaggedJSONSerializer()
+    session_class = StoredSession
+
+    def __init__(self, store):
+        self.store = store
+
+    def _decode(self, payload):
+        if payload[:1] == COMPRESSED_PAYLOAD:
+            payload = zlib.decompress(payload[1:])
+        else:
+            payload = payload[1:]
+        return self.serializer.loads(payload.decode("utf-8"))
+
+    def _encode(self, data):
+        payload = self.serializer.dumps(data).encode("utf-8")
+        if len(payload) > SESSION_COMPRESS_MIN_BYTES:
+            return COMPRESSED_PAYLOAD + zlib.compress(payload)
+        return RAW_PAYLOAD + payload
+
+    def _lifetime(self, app):
+        return app.permanent_session_lifetime.total_seconds()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            try:
+                payload, expires_at = self.store.load(sid)
+                if payload is not None:
+                    data = self._decode(payload)
+                    return self.session_class(data, sid=sid, digest=hashlib.sha1(payload).digest(), expires_at=expires_at)
+            except Exception as e:
+                logging.error(f"Error loading session: {e}")
+        session = self.session_class(sid=secrets.token_urlsafe(32), new=True)
+        session.permanent = app.config.get("SESSION_PERMANENT", True)
+        return session
+
+    def save_session(self, app, session, response):
+        cookie_name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(cookie_name, domain=domain, path=path)
+            return
+
+        payload = self._encode(dict(session))
+        lifetime = self._lifetime(app)
+        expires_at = time.time() + lifetime
+        changed = hashlib.sha1(payload).digest() != session.digest
+        if changed:
+            self.store.save(session.sid, payload, expires_at)
+        elif session.expires_at is not None and expires_at - session.expires_at > lifetime / 10:
+            self.store.touch(session.sid, expires_at)
+        else:
+            return  # Nothing to write and the cookie is already set
+
+        response.set_cookie(
+            cookie_name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def init_session(app):
+    """Install the SQLite session interface on the app."""
+    app.session_interface = SQLiteSessionInterface(SQLiteSessionStore(SESSION_SQLITE_PATH, SESSION_SWEEP_INTERVAL))
@@ -0,0 +1,137 @@
+# transcript_correction.py
+# Local correction of speech-to-text transcripts against an insurance glossary.
+# Reflect only falls back to the LLM correction prompt when this is not confident.
+import os
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from fuzzywuzzy import fuzz
+from question_bank import question_bank
+
+# "local": glossary correction with LLM fallback when unsure; "llm": always use the LLM
+TRANSCRIPT_CORRECTION_MODE = os.getenv("TRANSCRIPT_CORRECTION_MODE", "local")
+TRANSCRIPT_MATCH_THRESHOLD = int(os.getenv("TRANSCRIPT_MATCH_THRESHOLD", 88))  # Similarity at which a span is replaced by a term
+TRANSCRIPT_AMBIGUOUS_THRESHOLD = int(os.getenv("TRANSCRIPT_AMBIGUOUS_THRESHOLD", 72))  # Near misses between the two thresholds go to the LLM
+# The glossary is Latin-script; transcripts with a smaller share of Latin letters (e.g. Hindi) always go to the LLM
+TRANSCRIPT_MIN_LATIN_SHARE = float(os.getenv("TRANSCRIPT_MIN_LATIN_SHARE", 0.5))
+
+# Terms the transcription most often gets wrong (the same list the LLM prompt calls out)
+BASE_GLOSSARY = [
+    "Single Pay", "Limited Pay", "Regular Pay", "Deferment", "Assured Wealth Goal plan",
+    "surrender value", "premiums", "Life Stage", "Sum Assured", "terminal", "lump sum",
+    "Life Shield", "Death Benefit", "maturity benefit", "policy term", "premium payment term",
+]
+
+MIN_SINGLE_WORD_TERM = 6  # Shorter single words ("Pay") are only matched as part of a phrase
+TITLE_CASE_PHRASE = re.compile(r"\b[A-Z][a-zA-Z]+(?:\s+[A-Z][a-zA-Z]+){1,3}\b")
+# Capitalized only because they start a sentence or heading ("The Sum Assured", "Choose Limited Pay")
+LEADING_WORDS = {
+    "a", "an", "the", "this", "that", "these", "those", "your", "our", "you", "we", "it", "if", "in", "on",
+    "for", "with", "under", "after", "before", "during", "by", "at", "to", "of", "and", "or", "all", "any",
+    "each", "every", "choose", "select", "opt", "avail", "get", "enjoy", "receive", "buy", "pay", "check",
+    "note", "see", "what", "how", "when", "why", "who", "is", "are", "does", "do", "can", "will",
+}
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]+", re.UNICODE)
+INVISIBLE_CHARACTERS = dict.fromkeys(map(ord, "\u200b\u200c\u200d\ufeff"))  # Zero-width spaces/joiners, BOM
+
+
+@dataclass
+class CorrectionResult:
+    text: str
+    confident: bool
+    corrections: list = field(default_factory=list)  # (heard, replaced with, score)
+    near_misses: list = field(default_factory=list)  # (heard, closest term, score)
+
+
+def normalize_transcript(text):
+    """Unicode NFC, no zero-width characters, single spaces, spaced danda."""
+    text = unicodedata.normalize("NFC", text or "").translate(INVISIBLE_CHARACTERS)
+    text = re.sub(r"\s*।\s*", "। ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _comparable(text):
+    # Case-insensitive and without a plural "s", so "premium" is not "corrected" to "premiums"
+    words = [word[:-1] if len(word) > 3 and word.endswith("s") else word for word in text.lower().split()]
+    return " ".join(words)
+
+
+def latin_share(text):
+    """Share of the letters in text that are Latin script (1.0 for text without letters)."""
+    letters = [char for char in text if char.isalpha()]
+    if not letters:
+        return 1.0
+    return sum(1 for char in letters if "LATIN" in unicodedata.name(char, "")) / len(letters)
+
+
+def _glossary_phrase(phrase):
+    # Drop sentence-initial articles, pronouns and verbs; keep it only if a phrase remains
+    words = phrase.split()
+    while words and words[0].lower() in LEADING_WORDS:
+        words.pop(0)
+    return " ".join(words) if len(words) >= 2 else None
+
+
+def glossary_for(product_name):
+    """Base glossary plus the product name and the multi-word terms used in its answers."""
+    terms = {term.lower(): term for term in BASE_GLOSSARY}
+    if product_name:
+        terms.setdefault(product_name.lower(), product_name)
+        for _, _, answer in question_bank.questions(product_name, "English"):
+            for match in TITLE_CASE_PHRASE.findall(answer or ""):
+                phrase = _glossary_phrase(match)
+                if phrase:
+                    terms.setdefault(phrase.lower(), phrase)
+    return [term for term in terms.values() if " " in term or len(term) >= MIN_SINGLE_WORD_TERM]
+
+
+def correct_transcript(text, product_name=None):
+    """Replace near matches of glossary terms in a transcript.
+
+    A span of the same number of words as a term is replaced when its similarity
+    reaches TRANSCRIPT_MATCH_THRESHOLD. Spans scoring between the ambiguous and
+    match thresholds are near misses: the result is then not confident and the
+    caller should let the LLM decide. So should it for transcripts that are
+    mostly not Latin script, which the glossary cannot check.
+    """
+    text = normalize_transcript(text)
+    if latin_share(text) < TRANSCRIPT_MIN_LATIN_SHARE:
+        return CorrectionResult(text=text, confident=False)
+    tokens = [(match.group(), match.start(), match.end()) for match in TOKEN_PATTERN.finditer(text)]
+    words = [index for index, (token, _, _) in enumerate(tokens) if token[0].isalnum() or token[0] == "_"]
+    candidates = []
+    for term in glossary_for(product_name):
+        term_words = len(term.split())
+        comparable_term = _comparable(term)
+        for start in range(len(words) - term_words + 1):
+            first, last = words[start], words[start + term_words - 1]
+            span = text[tokens[first][1]:tokens[last][2]]
+            if _comparable(span) == comparable_term:
+                if span.lower() != term.lower():
+                    continue  # Only differs by a plural; leave it
+                candidates.append((100, first, last, span, term))
+                continue
+            score = fuzz.ratio(_comparable(span), comparable_term)
+            if score >= TRANSCRIPT_AMBIGUOUS_THRESHOLD:
+                candidates.append((score, first, last, span, term))
+
+    # Best matches first; spans may not overlap
+    taken = set()
+    replacements = []
+    result = CorrectionResult(text=text, confident=True)
+    for score, first, last, span, term in sorted(candidates, key=lambda c: (-c[0], c[1])):
+        if taken & set(range(first, last + 1)):
+            continue
+        if score >= TRANSCRIPT_MATCH_THRESHOLD:
+            taken.update(range(first, last + 1))
+            if span != term:
+                replacements.append((tokens[first][1], tokens[last][2], term))
+                result.corrections.append((span, term, score))
+        else:
+            result.near_misses.append((span, term, score))
+
+    for start, end, term in sorted(replacements, reverse=True):
+        text = text[:start] + term + text[end:]
+    result.text = text
+    result.confident = not result.near_misses
+    return result
@@ -0,0 +1,714 @@
+# tts_service.py
+# Shared Azure text-to-speech helpers used by Rehearse (main.py) and Reflect (reflect.py)
+import os
+import re
+import uuid
+import time
+import json
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import azure.cognitiveservices.speech as speechsdk
+from dotenv import load_dotenv
+from flask import Blueprint, Response, request, send_file, abort
+from flask_login import login_required
+from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadSignature
+
+load_dotenv()
+
+azure_subscription_key = os.getenv("AZURE_SUBSCRIPTION_KEY")
+azure_region = os.getenv("AZURE_REGION")
+secret_key = os.getenv("SECRET_KEY")
+
+tts_bp = Blueprint("tts", __name__, url_prefix="/tts")
+
+# How audio reaches the browser: "stream" pipes Azure output straight into the
+# HTTP response from /tts/stream, "file" synthesizes into static/ first
+TTS_DELIVERY = os.getenv("TTS_DELIVERY", "stream")
+TTS_STREAM_TOKEN_MAX_AGE = int(os.getenv("TTS_STREAM_TOKEN_MAX_AGE", 60 * 60))  # Seconds a stream URL stays valid
+TTS_STREAM_CHUNK_SIZE = 16 * 1024
+# Utterances behind stream URLs, shared by all workers; the URL only carries a signed key
+TTS_STREAM_REQUEST_DIR = os.getenv("TTS_STREAM_REQUEST_DIR", os.path.join("instance", "tts_stream_requests"))
+
+# Audio output formats: name -> (SpeechSynthesisOutputFormat member, file extension, content type).
+# Azure's default output is uncompressed 16 kHz RIFF/PCM, roughly 10x the size of 48 kbps MP3.
+AUDIO_FORMATS = {
+    "mp3-16k-32kbps": ("Audio16Khz32KBitRateMonoMp3", ".mp3", "audio/mpeg"),
+    "mp3-24k-48kbps": ("Audio24Khz48KBitRateMonoMp3", ".mp3", "audio/mpeg"),
+    "mp3-24k-96kbps": ("Audio24Khz96KBitRateMonoMp3", ".mp3", "audio/mpeg"),
+    "opus-webm-24k": ("Webm24Khz16BitMonoOpus", ".webm", "audio/webm"),
+    "opus-ogg-24k": ("Ogg24Khz16BitMonoOpus", ".ogg", "audio/ogg"),
+    "wav-24k": ("Riff24Khz16BitMonoPcm", ".wav", "audio/wav"),
+}
+TTS_OUTPUT_FORMAT = os.getenv("TTS_OUTPUT_FORMAT", "mp3-24k-48kbps")
+if TTS_OUTPUT_FORMAT not in AUDIO_FORMATS:
+    raise ValueError(f"Unknown TTS_OUTPUT_FORMAT '{TTS_OUTPUT_FORMAT}', expected one of {sorted(AUDIO_FORMATS)}")
+AUDIO_OUTPUT_FORMAT, AUDIO_EXTENSION, AUDIO_MIMETYPE = AUDIO_FORMATS[TTS_OUTPUT_FORMAT]
+AUDIO_EXTENSIONS = sorted({extension for _, extension, _ in AUDIO_FORMATS.values()})
+
+# Size budget for a single utterance; larger clips are logged as warnings
+TTS_AUDIO_BYTES_BUDGET = int(os.getenv("TTS_AUDIO_BYTES_BUDGET", 96 * 1024))
+
+# Cache configuration (override through the environment)
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "true").lower() == "true"
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join("static", "tts_cache"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", 500 * 1024 * 1024))  # 500 MB
+
+# Synthesizer pool configuration
+TTS_POOL_SIZE = int(os.getenv("TTS_POOL_SIZE", 4))  # Max synthesizers per voice in each worker
+TTS_POOL_PREWARM = int(os.getenv("TTS_POOL_PREWARM", 1))  # Pre-connected synthesizers per voice at startup
+TTS_POOL_CHECKOUT_TIMEOUT = float(os.getenv("TTS_POOL_CHECKOUT_TIMEOUT", 15))  # Seconds
+TTS_POOL_MAX_AGE = float(os.getenv("TTS_POOL_MAX_AGE", 30 * 60))  # Recycle synthesizers after 30 minutes
+
+# Background synthesis of utterances the user is about to hear (needs the cache)
+TTS_PREFETCH_WORKERS = int(os.getenv("TTS_PREFETCH_WORKERS", 2))
+TTS_PREFETCH_WAIT = float(os.getenv("TTS_PREFETCH_WAIT", 15))  # Max seconds to wait on an in-flight prefetch
+
+# Voice mappings for male and female personas, plus the English Reflect coach voice
+VOICE_MAPPING = {
+    "Male": "hi-IN-MadhurNeural",
+    "Female": "hi-IN-SwaraNeural"
+}
+ENGLISH_VOICE = "en-IN-PrabhatNeural"
+POOLED_VOICES = list(VOICE_MAPPING.values()) + [ENGLISH_VOICE]
+
+
+class TTSCache:
+    """Content-addressed cache of synthesized audio files.
+
+    Files are named by hash(voice, language, normalized text), so identical
+    utterances are synthesized once and then served from disk. The directory is
+    shared by all gunicorn workers: recency is tracked with the file mtime
+    (touched on every hit) and the least recently used files are evicted once
+    the directory grows past max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes, audio_format, extension):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.audio_format = audio_format
+        self.extension = extension
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._approx_bytes = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def normalize_text(text):
+        text = unicodedata.normalize("NFC", text or "")
+        return re.sub(r"\s+", " ", text).strip()
+
+    def key(self, voice, language, text):
+        raw = "\x1f".join([self.audio_format, voice or "", language or "", self.normalize_text(text)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key + self.extension)
+
+    def relative_name(self, key):
+        """File name relative to static/, as used in /static/... URLs."""
+        return os.path.relpath(self.path_for(key), "static").replace(os.sep, "/")
+
+    def lookup(self, key):
+        path = self.path_for(key)
+        if os.path.exists(path):
+            try:
+                os.utime(path)  # Mark as recently used for LRU eviction
+            except OSError:
+                pass
+            with self._lock:
+                self.hits += 1
+            logging.debug(f"TTS cache hit: {key}")
+            return path
+        with self._lock:
+            self.misses += 1
+        logging.debug(f"TTS cache miss: {key}")
+        return None
+
+    def temp_path_for(self, key):
+        return os.path.join(self.directory, f"{key}.{uuid.uuid4().hex}.tmp")
+
+    def publish(self, key, temp_path):
+        """Atomically move a fully written temp file into the cache."""
+        path = self.path_for(key)
+        os.replace(temp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            if self._approx_bytes is not None:
+                self._approx_bytes += size
+            over_quota = self._approx_bytes is None or self._approx_bytes > self.max_bytes
+        if over_quota:
+            self.evict()
+        return path
+
+    def evict(self):
+        """Delete least recently used files until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # Removed by another worker
+            if entry.name.endswith(".tmp"):
+                if time.time() - stat.st_mtime > 60 * 60:
+                    _remove_quietly(entry.path)  # Left behind by an interrupted synthesis
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        evicted = 0
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                evicted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        with self._lock:
+            self._approx_bytes = total
+            self.evictions += evicted
+        if evicted:
+            logging.info(f"TTS cache evicted {evicted} files, {total / 1024 ** 2:.2f} MB in use")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "approx_bytes": self._approx_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+tts_cache = TTSCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES, TTS_OUTPUT_FORMAT, AUDIO_EXTENSION)
+
+
+class StreamRequestStore:
+    """Text, voice and language of pending stream URLs, one small JSON file per cache key.
+
+    Keeping the utterance server-side keeps stream URLs short: long Hindi
+    feedback embedded in the URL overran gunicorn's request-line limit.
+    Entries expire with the stream token and are swept periodically.
+    """
+
+    def __init__(self, directory, max_age):
+        self.directory = directory
+        self.max_age = max_age
+        self._last_sweep = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def put(self, text, voice, language):
+        key = tts_cache.key(voice, language, text)
+        path = self.path_for(key)
+        if os.path.exists(path):
+            os.utime(path)  # Restart its lifetime along with the new token
+        else:
+            temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"text": text, "voice": voice, "language": language}, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        self.maybe_sweep()
+        return key
+
+    def get(self, key):
+        """The stored request, or None if it is unknown or expired."""
+        path = self.path_for(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def maybe_sweep(self):
+        now = time.time()
+        if now - self._last_sweep < self.max_age / 10:
+            return
+        self._last_sweep = now
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+stream_requests = StreamRequestStore(TTS_STREAM_REQUEST_DIR, TTS_STREAM_TOKEN_MAX_AGE)
+
+
+class AudioStats:
+    """Per-worker counters of generated audio, to keep an eye on download size."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.utterances = 0
+        self.bytes = 0
+        self.over_budget = 0
+        self._lock = threading.Lock()
+
+    def record(self, text, size):
+        with self._lock:
+            self.utterances += 1
+            self.bytes += size
+            over = size > self.budget
+            if over:
+                self.over_budget += 1
+        logging.info(f"TTS audio: {size / 1024:.1f} KB {TTS_OUTPUT_FORMAT} for {len(text)} chars")
+        if over:
+            logging.warning(f"TTS audio of {size / 1024:.1f} KB exceeds the {self.budget / 1024:.0f} KB budget for text [{text}]")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "format": TTS_OUTPUT_FORMAT,
+                "utterances": self.utterances,
+                "bytes": self.bytes,
+                "avg_bytes": self.bytes / self.utterances if self.utterances else 0,
+                "over_budget": self.over_budget,
+            }
+
+
+audio_stats = AudioStats(TTS_AUDIO_BYTES_BUDGET)
+
+
+class PooledSynthesizer:
+    """An Azure SpeechSynthesizer for one voice with a pre-opened service connection.
+
+    Synthesizers are created without an audio output so the same instance can be
+    reused for any number of requests; callers receive result.audio_data.
+    """
+
+    def __init__(self, voice):
+        speech_config = speechsdk.SpeechConfig(subscription=azure_subscription_key, region=azure_region)
+        speech_config.speech_synthesis_voice_name = voice
+        speech_config.set_speech_synthesis_output_format(getattr(speechsdk.SpeechSynthesisOutputFormat, AUDIO_OUTPUT_FORMAT))
+        self.voice = voice
+        self.synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+        self.created_at = time.monotonic()
+        self.failures = 0
+        self.connected = False
+        self.connection = speechsdk.Connection.from_speech_synthesizer(self.synthesizer)
+        self.connection.connected.connect(self._on_connected)
+        self.connection.disconnected.connect(self._on_disconnected)
+        self.connection.open(True)  # Pre-connect so the first request skips connection setup
+
+    def _on_connected(self, evt):
+        self.connected = True
+
+    def _on_disconnected(self, evt):
+        self.connected = False
+
+    def is_healthy(self):
+        if self.failures:
+            return False
+        return time.monotonic() - self.created_at < TTS_POOL_MAX_AGE
+
+    def reconnect_if_needed(self):
+        if not self.connected:
+            self.connection.open(True)
+
+    def close(self):
+        try:
+            self.connection.close()
+        except Exception as e:
+            logging.debug(f"Error closing synthesizer connection for {self.voice}: {e}")
+
+
+class _PoolWaiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.synthesizer = None
+        self.may_create = False
+
+
+class SynthesizerPool:
+    """Bounded per-voice pool of PooledSynthesizer instances.
+
+    Checkout is first come, first served: when every synthesizer for a voice is
+    busy, callers queue up and a released synthesizer is handed directly to the
+    longest waiting caller. Unhealthy instances are discarded on release or
+    checkout and replaced lazily.
+    """
+
+    def __init__(self, max_size, checkout_timeout):
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._created = {}
+        self._waiters = {}
+
+    def _slot(self, voice):
+        self._idle.setdefault(voice, deque())
+        self._created.setdefault(voice, 0)
+        self._waiters.setdefault(voice, deque())
+        return self._idle[voice], self._waiters[voice]
+
+    def _create(self, voice):
+        try:
+            return PooledSynthesizer(voice)
+        except Exception:
+            with self._lock:
+                self._created[voice] -= 1
+            raise
+
+    def acquire(self, voice, timeout=None):
+        timeout = self.checkout_timeout if timeout is None else timeout
+        with self._lock:
+            idle, waiters = self._slot(voice)
+            while idle and not waiters:
+                synthesizer = idle.popleft()
+                if synthesizer.is_healthy():
+                    return synthesizer
+                self._created[voice] -= 1
+                synthesizer.close()
+            if self._created[voice] < self.max_size and not waiters:
+                self._created[voice] += 1
+                waiter = None
+            else:
+                waiter = _PoolWaiter()
+                waiters.append(waiter)
+
+        if waiter is None:
+            return self._create(voice)
+
+        if not waiter.event.wait(timeout):
+            with self._lock:
+                if not waiter.event.is_set():
+                    waiters.remove(waiter)
+                    raise TimeoutError(f"Timed out waiting {timeout}s for a '{voice}' speech synthesizer")
+        if waiter.may_create:
+            return self._create(voice)
+        return waiter.synthesizer
+
+    def release(self, synthesizer, healthy=True):
+        voice = synthesizer.voice
+        with self._lock:
+            idle, waiters = self._slot(voice)
+            if not healthy or not synthesizer.is_healthy():
+                self._created[voice] -= 1
+                synthesizer.close()
+                if waiters:
+                    # Let the next caller build a replacement instead of waiting for one
+                    waiter = waiters.popleft()
+                    waiter.may_create = True
+                    self._created[voice] += 1
+                    waiter.event.set()
+                return
+            if waiters:
+                waiter = waiters.popleft()
+                waiter.synthesizer = synthesizer
+                waiter.event.set()
+            else:
+                idle.append(synthesizer)
+
+    @contextmanager
+    def checkout(self, voice, timeout=None):
+        synthesizer = self.acquire(voice, timeout)
+        healthy = True
+        try:
+            synthesizer.reconnect_if_needed()
+            yield synthesizer
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            self.release(synthesizer, healthy=healthy)
+
+    def prewarm(self, voices, count):
+        """Open `count` connections per voice ahead of the first request."""
+        for voice in voices:
+            synthesizers = []
+            try:
+                for _ in range(count):
+                    synthesizers.append(self.acquire(voice))
+            except Exception as e:
+                logging.error(f"Could not pre-connect speech synthesizer for {voice}: {e}")
+            for synthesizer in synthesizers:
+                self.release(synthesizer)
+
+    def stats(self):
+        with self._lock:
+            return {
+                voice: {
+                    "created": self._created[voice],
+                    "idle": len(self._idle[voice]),
+                    "waiting": len(self._waiters[voice]),
+                }
+                for voice in self._created
+            }
+
+
+synthesizer_pool = SynthesizerPool(TTS_POOL_SIZE, TTS_POOL_CHECKOUT_TIMEOUT)
+
+
+def start_pool_prewarm():
+    """Pre-connect pooled synthesizers for every app voice in the background."""
+    if TTS_POOL_PREWARM > 0:
+        threading.Thread(
+            target=synthesizer_pool.prewarm,
+            args=(POOLED_VOICES, TTS_POOL_PREWARM),
+            name="tts-pool-prewarm",
+            daemon=True,
+        ).start()
+
+
+def synthesize_bytes(text, voice):
+    """Synthesize text in memory with a pooled synthesizer and return the audio bytes (None on failure)."""
+    started = time.perf_counter()
+    with synthesizer_pool.checkout(voice) as pooled:
+        result = pooled.synthesizer.speak_text_async(text).get()
+        if result.reason == speechsdk.ResultReason.Canceled:
+            cancellation_details = result.cancellation_details
+            if cancellation_details.reason == speechsdk.CancellationReason.Error:
+                pooled.failures += 1  # Drop this instance when it goes back to the pool
+            logging.error(f"Speech synthesis canceled for [{text}]: {cancellation_details.reason} {cancellation_details.error_details}")
+            return None
+
+    if result.reason != speechsdk.ResultReason.SynthesizingAudioCompleted:
+        return None
+    logging.debug(f"Speech synthesized in {time.perf_counter() - started:.2f}s for text [{text}]")
+    audio_stats.record(text, len(result.audio_data))
+    return result.audio_data
+
+
+def _synthesize(text, voice, output_path):
+    audio_data = synthesize_bytes(text, voice)
+    if audio_data is None:
+        return False
+    with open(output_path, "wb") as audio_file:
+        audio_file.write(audio_data)
+    return True
+
+
+def synthesize_to_file(text, voice, language):
+    """Synthesize text and return the audio file name relative to static/ (None on failure).
+
+    Served from the TTS cache when the same voice, language and text were
+    synthesized before. This call blocks; wrap it in asyncio.to_thread from async views.
+    """
+    if not TTS_CACHE_ENABLED:
+        audio_file_name = str(uuid.uuid4()) + AUDIO_EXTENSION
+        return audio_file_name if _synthesize(text, voice, f"static/{audio_file_name}") else None
+
+    key = tts_cache.key(voice, language, text)
+    if tts_cache.lookup(key):
+        return tts_cache.relative_name(key)
+
+    temp_path = tts_cache.temp_path_for(key)
+    try:
+        if not _synthesize(text, voice, temp_path):
+            return None
+        tts_cache.publish(key, temp_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return tts_cache.relative_name(key)
+
+
+def stream_synthesis(text, voice, language):
+    """Yield audio chunks while Azure is still synthesizing them.
+
+    With the cache enabled the chunks are also written to a temp file, which is
+    published to the cache only once the whole utterance has been received.
+    """
+    key = tts_cache.key(voice, language, text) if TTS_CACHE_ENABLED else None
+    temp_path = tts_cache.temp_path_for(key) if key else None
+    temp_file = open(temp_path, "wb") if temp_path else None
+    completed = False
+    streamed_bytes = 0
+    try:
+        with synthesizer_pool.checkout(voice) as pooled:
+            result = pooled.synthesizer.start_speaking_text_async(text).get()
+            audio_stream = speechsdk.AudioDataStream(result)
+            buffer = bytes(TTS_STREAM_CHUNK_SIZE)
+            try:
+                filled = audio_stream.read_data(buffer)
+                while filled > 0:
+                    chunk = buffer[:filled]
+                    streamed_bytes += filled
+                    if temp_file:
+                        temp_file.write(chunk)
+                    yield chunk
+                    filled = audio_stream.read_data(buffer)
+                completed = audio_stream.status == speechsdk.StreamStatus.AllData
+                if completed:
+                    audio_stats.record(text, streamed_bytes)
+                else:
+                    details = audio_stream.cancellation_details
+                    if details and details.reason == speechsdk.CancellationReason.Error:
+                        pooled.failures += 1
+                    logging.error(f"Streaming synthesis did not complete for [{text}]: {details.error_details if details else audio_stream.status}")
+            finally:
+                if not completed:
+                    # Client went away or synthesis failed: stop before the synthesizer is reused
+                    pooled.synthesizer.stop_speaking_async().get()
+        if temp_file:
+            temp_file.close()
+            temp_file = None
+            if completed:
+                tts_cache.publish(key, temp_path)
+    finally:
+        if temp_file:
+            temp_file.close()
+        if temp_path:
+            _remove_quietly(temp_path)
+
+
+def speech_url(text, voice, language):
+    """Return a URL the browser can play for text (None on failure).
+
+    Cached audio is served straight from /static. Otherwise, in "stream" delivery
+    mode a signed /tts/stream URL is returned and synthesis only starts when the
+    browser requests it; in "file" mode the audio is synthesized to disk first.
+    This call may block; wrap it in asyncio.to_thread from async views.
+    """
+    if TTS_CACHE_ENABLED:
+        key = tts_cache.key(voice, language, text)
+        if tts_cache.lookup(key):
+            return f"/static/{tts_cache.relative_name(key)}"
+
+    if TTS_DELIVERY == "stream":
+        token = URLSafeTimedSerializer(secret_key).dumps(stream_requests.put(text, voice, language), salt="tts-stream")
+        return f"/tts/stream/{token}"
+
+    audio_file_name = synthesize_to_file(text, voice, language)
+    return f"/static/{audio_file_name}" if audio_file_name else None
+
+
+class SpeechPrefetcher:
+    """Synthesizes upcoming utterances into the TTS cache ahead of time.
+
+    In-flight prefetches are tracked per cache key, so asking for the same
+    utterance again waits on the running synthesis instead of starting another.
+    Prefetches are per process; a request served by another worker just finds
+    the cached file once it is published, or synthesizes it itself.
+    """
+
+    def __init__(self, max_workers):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts-prefetch")
+        self._lock = threading.Lock()
+        self._inflight = {}  # Cache key -> Future of synthesize_to_file
+
+    def prefetch(self, text, voice, language):
+        """Start synthesizing text in the background unless it is cached or already running."""
+        if not TTS_CACHE_ENABLED or not text:
+            return None
+        key = tts_cache.key(voice, language, text)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future or tts_cache.lookup(key):
+                return future
+            future = self.executor.submit(synthesize_to_file, text, voice, language)
+            self._inflight[key] = future
+        future.add_done_callback(lambda _: self._forget(key, future))
+        return future
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def wait(self, text, voice, language, timeout=TTS_PREFETCH_WAIT):
+        """Block until an in-flight prefetch of text finishes (no-op if there is none)."""
+        if not TTS_CACHE_ENABLED:
+            return
+        with self._lock:
+            future = self._inflight.get(tts_cache.key(voice, language, text))
+        if future:
+            try:
+                future.result(timeout=timeout)
+            except Exception as e:
+                logging.warning(f"Prefetched speech was not ready: {e}")
+
+
+speech_prefetcher = SpeechPrefetcher(TTS_PREFETCH_WORKERS)
+
+
+def prefetched_speech_url(text, voice, language):
+    """speech_url, after waiting for any in-flight prefetch of the same utterance."""
+    speech_prefetcher.wait(text, voice, language)
+    return speech_url(text, voice, language)
+
+
+def _resume_stream(first_chunk, chunks):
+    try:
+        yield first_chunk
+        yield from chunks
+    finally:
+        chunks.close()  # Stops synthesis if the client goes away
+
+
+@tts_bp.route("/stream/<token>", methods=["GET"])
+@login_required
+def stream_audio(token):
+    try:
+        key = URLSafeTimedSerializer(secret_key).loads(token, salt="tts-stream", max_age=TTS_STREAM_TOKEN_MAX_AGE)
+    except (SignatureExpired, BadSignature):
+        abort(404)
+    stream_request = stream_requests.get(key)
+    if stream_request is None:
+        abort(404)
+    text, voice, language = stream_request["text"], stream_request["voice"], stream_request["language"]
+
+    if TTS_CACHE_ENABLED:
+        cached_path = tts_cache.lookup(tts_cache.key(voice, language, text))
+        if cached_path:
+            return send_file(cached_path, mimetype=AUDIO_MIMETYPE, conditional=True)
+
+    # Browsers open <audio> with "Range: bytes=0-", which the stream below
+    # satisfies; only a seek into the middle needs the whole file first
+    if request.range and request.range.ranges != [(0, None)]:
+        # Replay seeking into audio we don't have yet: synthesize fully, then slice
+        if TTS_CACHE_ENABLED:
+            audio_file_name = synthesize_to_file(text, voice, language)
+            if audio_file_name is None:
+                abort(502)
+            return send_file(os.path.join("static", audio_file_name), mimetype=AUDIO_MIMETYPE, conditional=True)
+        audio_data = synthesize_bytes(text, voice)
+        if audio_data is None:
+            abort(502)
+        response = Response(audio_data, mimetype=AUDIO_MIMETYPE)
+        return response.make_conditional(request, accept_ranges=True, complete_length=len(audio_data))
+
+    # Wait for the first chunk, so a failed synthesis is a 502 the player can
+    # report rather than an empty 200
+    chunks = stream_synthesis(text, voice, language)
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        abort(502)
+    # A plain 200 that declines ranges: the player shouldn't seek in a stream
+    # whose length isn't known yet; replays are served ranged from the cache
+    response = Response(_resume_stream(first_chunk, chunks), mimetype=AUDIO_MIMETYPE)
+    response.headers["Accept-Ranges"] = "none"
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,260 @@
+# vector_index.py
+# The Recall FAISS index, loaded once per process and kept in memory.
+# Ingestion publishes each index as a new version directory and then flips a
+# pointer file; readers notice the new version and swap it in atomically.
+# Each version carries a manifest of its documents and their chunk hashes, so
+# uploads only embed new chunks and a document can be removed on its own.
+import os
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from langchain_community.vectorstores import FAISS
+
+FAISS_INDEX_DIR = os.getenv("FAISS_INDEX_DIR", "faiss_index")
+FAISS_RELOAD_CHECK_INTERVAL = float(os.getenv("FAISS_RELOAD_CHECK_INTERVAL", 2))  # Seconds between checks for a new version
+FAISS_KEEP_VERSIONS = int(os.getenv("FAISS_KEEP_VERSIONS", 3))  # Published versions kept on disk
+EMBEDDING_MODEL = "models/embedding-001"
+CURRENT_POINTER = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+PUBLISH_LOCK_FILE = ".publish.lock"
+LEGACY_VERSION = "legacy"  # index.faiss/index.pkl directly in FAISS_INDEX_DIR, from before versioning
+LEGACY_DOCUMENT = "legacy"  # Manifest entry for the chunks of an index built before manifests
+LEGACY_DOCUMENT_NAME = "Documents indexed before tracking"
+
+
+def chunk_hash(text):
+    """Docstore id of a chunk: identical text (up to whitespace) is embedded once."""
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+class ReadWriteLock:
+    """Any number of readers or one writer; a waiting writer blocks new readers."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writer or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class ResidentIndex:
+    """A FAISS vector store kept in memory and hot-swapped when a new version is published."""
+
+    def __init__(self, directory, check_interval, keep_versions):
+        self.directory = directory
+        self.versions_dir = os.path.join(directory, "versions")
+        self.check_interval = check_interval
+        self.keep_versions = keep_versions
+        self._lock = ReadWriteLock()
+        self._reload_lock = threading.Lock()  # One load at a time; readers keep using the old store meanwhile
+        self._store = None
+        self._version = None
+        self._last_check = 0
+        self._embeddings = None
+
+    def embeddings(self):
+        if self._embeddings is None:
+            self._embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
+        return self._embeddings
+
+    def current_version(self):
+        """The published version name, LEGACY_VERSION for an unversioned index, or None."""
+        try:
+            with open(os.path.join(self.directory, CURRENT_POINTER)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            if os.path.exists(os.path.join(self.directory, "index.faiss")):
+                return LEGACY_VERSION
+            return None
+
+    def path_for(self, version):
+        return self.directory if version == LEGACY_VERSION else os.path.join(self.versions_dir, version)
+
+    def refresh(self, force=False):
+        """Swap in the published version if it changed (checked at most every check_interval seconds)."""
+        now = time.monotonic()
+        if not force and self._store is not None and now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        version = self.current_version()
+        if version is None or version == self._version:
+            return
+        with self._reload_lock:
+            if version == self._version:
+                return
+            started = time.perf_counter()
+            store = FAISS.load_local(self.path_for(version), self.embeddings(), allow_dangerous_deserialization=True)
+            with self._lock.write():
+                self._store, self._version = store, version
+            logging.info(f"Loaded FAISS index version {version} in {time.perf_counter() - started:.2f}s")
+
+    def similarity_search(self, query, k=4):
+        """Documents closest to query; empty if nothing has been indexed yet."""
+        self.refresh()
+        # Only the reference is taken under the lock: the search embeds the query
+        # remotely, and a swap must not wait for that. A replaced store stays
+        # valid for searches already using it.
+        with self._lock.read():
+            store = self._store
+        if store is None:
+            return []
+        return store.similarity_search(query, k=k)
+
+    def documents(self):
+        """Manifest entries of the published version: document id -> {"name", "chunks", "added_at"}."""
+        version = self.current_version()
+        if version is None:
+            return {}
+        manifest = self._read_manifest(version)
+        if manifest is None:
+            return {LEGACY_DOCUMENT: {"name": LEGACY_DOCUMENT_NAME, "chunks": [], "added_at": None}}
+        return manifest["documents"]
+
+    def _read_manifest(self, version):
+        try:
+            with open(os.path.join(self.path_for(version), MANIFEST_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def _publish_lock(self):
+        # Serializes read-modify-publish cycles across worker processes
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, PUBLISH_LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_for_update(self):
+        """A private copy of the published store and its manifest (never the one readers use)."""
+        version = self.current_version()
+        if version is None:
+            return None, {"documents": {}}
+        store = FAISS.load_local(self.path_for(version), self.embeddings(), allow_dangerous_deserialization=True)
+        manifest = self._read_manifest(version)
+        if manifest is None:
+            chunks = list(store.index_to_docstore_id.values())
+            manifest = {"documents": {LEGACY_DOCUMENT: {"name": LEGACY_DOCUMENT_NAME, "chunks": chunks, "added_at": None}}}
+        return store, manifest
+
+    def add_document(self, document_id, name, chunks):
+        """Index a document's text chunks, embedding only chunks not already in the index.
+
+        Returns the number of newly embedded chunks. Nothing is published when
+        the document is already indexed.
+        """
+        with self._publish_lock():
+            store, manifest = self._load_for_update()
+            if document_id in manifest["documents"]:
+                return 0
+            known = set(store.index_to_docstore_id.values()) if store is not None else set()
+            hashes, new_texts, new_ids = [], [], []
+            seen = set()
+            for chunk in chunks:
+                digest = chunk_hash(chunk)
+                if digest in seen:
+                    continue
+                seen.add(digest)
+                hashes.append(digest)
+                if digest not in known:
+                    new_texts.append(chunk)
+                    new_ids.append(digest)
+            if not hashes:
+                return 0
+
+            if new_texts:
+                metadatas = [{"document": document_id, "source": name} for _ in new_texts]
+                if store is None:
+                    store = FAISS.from_texts(new_texts, self.embeddings(), metadatas=metadatas, ids=new_ids)
+                else:
+                    store.add_texts(new_texts, metadatas=metadatas, ids=new_ids)
+            manifest["documents"][document_id] = {"name": name, "chunks": hashes, "added_at": time.time()}
+            version = self.publish(store, manifest)
+            logging.info(f"Indexed {name}: {len(new_texts)} new of {len(hashes)} chunks, version {version}")
+            return len(new_texts)
+
+    def remove_document(self, document_id):
+        """Remove a document and the vectors no other document shares.
+
+        Returns the number of vectors deleted, or None if the document is not indexed.
+        """
+        with self._publish_lock():
+            store, manifest = self._load_for_update()
+            entry = manifest["documents"].pop(document_id, None)
+            if entry is None or store is None:
+                return None
+            still_used = set()
+            for other in manifest["documents"].values():
+                still_used.update(other["chunks"])
+            stale = [digest for digest in entry["chunks"] if digest not in still_used]
+            if stale:
+                store.delete(stale)
+            version = self.publish(store, manifest)
+            logging.info(f"Removed {entry['name']}: {len(stale)} chunks, version {version}")
+            return len(stale)
+
+    def publish(self, vector_store, manifest):
+        """Save vector_store and its manifest as a new version and point readers at it."""
+        os.makedirs(self.versions_dir, exist_ok=True)
+        version = time.strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:8]
+        temp_dir = os.path.join(self.versions_dir, f".{version}.tmp")
+        vector_store.save_local(temp_dir)
+        with open(os.path.join(temp_dir, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f)
+        os.replace(temp_dir, os.path.join(self.versions_dir, version))
+
+        pointer_temp = os.path.join(self.directory, f".{CURRENT_POINTER}.{os.getpid()}.tmp")
+        with open(pointer_temp, "w") as f:
+            f.write(version)
+        os.replace(pointer_temp, os.path.join(self.directory, CURRENT_POINTER))
+        self._prune(version)
+        return version
+
+    def _prune(self, current):
+        # Keep a few old versions: other workers may still be loading them
+        versions = sorted(name for name in os.listdir(self.versions_dir) if not name.startswith("."))
+        for name in versions[:-self.keep_versions]:
+            if name != current:
+                shutil.rmtree(os.path.join(self.versions_dir, name), ignore_errors=True)
+
+
+resident_index = ResidentIndex(FAISS_INDEX_DIR, FAISS_RELOAD_CHECK_INTERVAL, FAISS_KEEP_VERSIONS)
@@ -0,0 +1,15 @@
+# worker.py
+# Runs queued background jobs (conversation feedback, document ingestion) outside
+# the gunicorn web workers, so slow LLM and OCR work cannot starve other users.
+#
+# Usage: python worker.py [--once]
+import os
+import sys
+
+if __name__ == "__main__":
+    # The worker serves no requests: skip the speech pool prewarm and the metrics sampler
+    os.environ.setdefault("BACKGROUND_SERVICES", "false")
+    from main import app
+    from job_queue import run_worker
+
+    run_worker(app, once="--once" in sys.argv)